@@ -0,0 +1,238 @@
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import argparse
+import platform
+import subprocess
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, List
+from benchmarks.fixtures import DEFAULT_LENGTHS, generate_fixtures
+from benchmarks.media_server import MediaServer
+from controller.metrics import child_cpu_time, resource
+
+# Offline benchmarks of the trim, transcode and queue paths and of the view's polling loop.
+# Run with python -m benchmarks.bench, compare two runs with --compare
+
+RESULTS_VERSION = 1
+BENCHMARKS = ('trim', 'transcode', 'queue', 'view')
+
+def peak_rss(who: int) -> int:
+    if resource is None:
+        return 0
+    # Kilobytes on Linux, bytes on macOS
+    return resource.getrusage(who).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+
+def measure(function: Callable[..., Dict[str, any] | None], *args) -> Dict[str, any]:
+    start, cpu, children = time.perf_counter(), time.process_time(), child_cpu_time()
+    result = function(*args) or {}
+    metrics = {
+        'seconds': time.perf_counter() - start,
+        'cpu_seconds': time.process_time() - cpu,
+        'child_cpu_seconds': child_cpu_time() - children,
+    }
+    if resource is not None:
+        metrics['peak_rss_bytes'] = peak_rss(resource.RUSAGE_SELF)
+        metrics['peak_child_rss_bytes'] = peak_rss(resource.RUSAGE_CHILDREN)
+    return {**metrics, **result}
+
+def run_isolated(function: Callable[..., Dict[str, any] | None], *args) -> Dict[str, any]:
+    # Every measurement gets a fresh process, so the peak RSS is its own and nothing is cached
+    # A failing benchmark is recorded as such, the others still run
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+        try:
+            return executor.submit(measure, function, *args).result()
+        except Exception as e:
+            return {'error': f'{type(e).__name__}: {e}'}
+
+def trim(fixture: str, seconds: int, work_dir: str, sample_accurate: bool) -> None:
+    from controller.controller import Controller
+    from utils.utils import get_timestamp
+    os.chdir(work_dir)
+    # The trimmed file is written next to its source, a link keeps it out of the fixtures
+    source = os.path.join(work_dir, os.path.basename(fixture))
+    if not os.path.exists(source):
+        os.symlink(fixture, source)
+    controller = Controller()
+    controller.sample_accurate_trim = sample_accurate
+    # The middle half of the audio
+    trim_timestamps = {'start': get_timestamp(seconds * 250), 'end': get_timestamp(seconds * 750)}
+    controller.trim_file(source, trim_timestamps)
+
+def transcode(url: str, work_dir: str, method: str) -> Dict[str, any]:
+    # One download of the default mp3-192 profile through the controller, so the extraction with its
+    # tagging, the loudness normalization and the streaming transcode are what is measured
+    from controller.controller import Controller
+    os.chdir(work_dir)
+    controller = Controller()
+    controller.max_workers = 1
+    controller.use_archive = False
+    controller.save_dir = os.path.join(work_dir, 'transcoded')
+    controller.streaming = method == 'stream'
+    controller.normalize_loudness = method == 'loudnorm'
+    controller.ydl_opts.update({'quiet': True, 'noprogress': True})
+
+    job = controller.submit(controller.create_job(url, f'transcoded-{method}'))
+    controller.wait([job])
+    controller.shutdown()
+    if job.state != Controller.State.DONE:
+        raise RuntimeError(f'The {method} job failed: {job.error_message}')
+    output_bytes = os.path.getsize(job.save_path)
+    os.remove(job.save_path)
+    return {'output_bytes': output_bytes}
+
+def queue(urls: List[str], workers: int, work_dir: str) -> Dict[str, any]:
+    from controller.controller import Controller
+    os.chdir(work_dir)
+    controller = Controller()
+    controller.max_workers = workers
+    controller.use_archive = False
+    controller.save_dir = os.path.join(work_dir, 'downloads')
+    controller.ydl_opts.update({'quiet': True, 'noprogress': True})
+
+    start = time.perf_counter()
+    jobs = [controller.submit(controller.create_job(url, f'job-{index}')) for index, url in enumerate(urls)]
+    controller.wait(jobs)
+    seconds = time.perf_counter() - start
+    controller.shutdown()
+    return {'jobs_per_second': len(jobs) / seconds,
+            'failed': sum(1 for job in jobs if job.state != Controller.State.DONE)}
+
+def view_idle(seconds: float, work_dir: str) -> Dict[str, any]:
+    if sys.platform.startswith('linux') and not os.environ.get('DISPLAY'):
+        return {'skipped': 'no display'}
+    from controller.controller import Controller
+    from view.view import View
+    os.chdir(work_dir)
+    view = View(Controller())
+    view.update()
+    # Only the idle polling is measured, not building the window
+    cpu = time.process_time()
+    view.after(int(seconds * 1000), view.quit)
+    view.mainloop()
+    idle_cpu = time.process_time() - cpu
+    view.destroy()
+    return {'idle_cpu_seconds': idle_cpu, 'idle_cpu_percent': idle_cpu / seconds * 100}
+
+def run(args: argparse.Namespace) -> List[Dict[str, any]]:
+    fixtures = generate_fixtures(args.fixtures_dir, args.lengths)
+    results = []
+
+    def record(name: str, params: Dict[str, any], metrics: Dict[str, any]) -> None:
+        results.append({'name': name, 'params': params, 'metrics': metrics})
+        print(f'[Benchmark] {name} {params} {metrics}', file=sys.stderr)
+
+    with tempfile.TemporaryDirectory(prefix='mp3-yt-downloader-bench-') as work_dir:
+        if 'trim' in args.only:
+            for seconds, fixture in fixtures.items():
+                record('trim', {'length': seconds, 'method': 'stream_copy'},
+                       run_isolated(trim, fixture, seconds, work_dir, False))
+                # Decoding holds the whole audio in memory, long fixtures would only measure swapping
+                if seconds <= args.max_decode_length:
+                    record('trim', {'length': seconds, 'method': 'sample_accurate'},
+                           run_isolated(trim, fixture, seconds, work_dir, True))
+
+        if 'transcode' in args.only:
+            server = MediaServer(args.fixtures_dir).start()
+            try:
+                for seconds, fixture in fixtures.items():
+                    # The measurement is a second decode of the whole audio, like the sample accurate trim
+                    methods = ('extract', 'stream') + (('loudnorm',) if seconds <= args.max_decode_length else ())
+                    for method in methods:
+                        metrics = run_isolated(transcode, server.url(fixture), work_dir, method)
+                        if 'seconds' in metrics:
+                            metrics['audio_seconds_per_second'] = seconds / metrics['seconds']
+                        record('transcode', {'length': seconds, 'codec': 'mp3', 'method': method}, metrics)
+            finally:
+                server.stop()
+
+        if 'queue' in args.only:
+            server = MediaServer(args.fixtures_dir, args.rate).start()
+            try:
+                urls = [server.url(fixtures[min(fixtures)])] * args.jobs
+                for workers in args.workers:
+                    queue_dir = os.path.join(work_dir, f'queue-{workers}')
+                    os.makedirs(queue_dir)
+                    record('queue', {'workers': workers, 'jobs': args.jobs, 'length': min(fixtures), 'rate': args.rate},
+                           run_isolated(queue, urls, workers, queue_dir))
+            finally:
+                server.stop()
+
+        if 'view' in args.only:
+            record('view', {'seconds': args.view_seconds}, run_isolated(view_idle, args.view_seconds, work_dir))
+
+    return results
+
+def environment() -> Dict[str, any]:
+    ffmpeg = subprocess.run(['ffmpeg', '-version'], capture_output=True, text=True).stdout.split('\n', 1)[0]
+    from yt_dlp.version import __version__ as yt_dlp_version
+    return {'python': platform.python_version(), 'platform': platform.platform(), 'cpu_count': os.cpu_count(),
+            'ffmpeg': ffmpeg, 'yt_dlp': yt_dlp_version}
+
+def result_key(result: Dict[str, any]) -> str:
+    return f"{result['name']}[{','.join(f'{key}={value}' for key, value in sorted(result['params'].items()))}]"
+
+def compare(baseline: Dict[str, any], current: Dict[str, any], tolerance: float, min_seconds: float = 0.1) -> List[str]:
+    # Rates are better when higher, everything else (time, CPU, memory) when lower
+    regressions = []
+    baseline_results = {result_key(result): result['metrics'] for result in baseline['results']}
+    for result in current['results']:
+        previous = baseline_results.get(result_key(result))
+        if previous is None:
+            continue
+        for metric, value in result['metrics'].items():
+            old = previous.get(metric)
+            if not isinstance(value, (int, float)) or not isinstance(old, (int, float)) or old == 0:
+                continue
+            # Differences in a few milliseconds are noise
+            if metric.endswith('seconds') and max(old, value) < min_seconds:
+                continue
+            change = value / old - 1
+            worse = -change if metric.endswith('per_second') else change
+            print(f'[Compare] {result_key(result)} {metric}: {old:.4g} -> {value:.4g} ({change:+.1%})', file=sys.stderr)
+            if worse > tolerance:
+                regressions.append(f'{result_key(result)} {metric} {change:+.1%}')
+    return regressions
+
+def parse_list(value: str) -> List[int]:
+    return [int(part) for part in value.split(',') if part.strip()]
+
+def main(argv: List[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.bench', description='Offline benchmarks, results are written as JSON.')
+    parser.add_argument('-o', '--output', default=f"benchmark-{time.strftime('%Y%m%d-%H%M%S')}.json", help='file to write the results to')
+    parser.add_argument('--fixtures-dir', default=os.path.join('.benchmarks', 'fixtures'), help='where the generated audio is kept between runs')
+    parser.add_argument('--lengths', type=parse_list, default=list(DEFAULT_LENGTHS), help='fixture lengths in seconds, e.g. "60,600"')
+    parser.add_argument('--only', type=lambda value: value.split(','), default=list(BENCHMARKS), help=f"subset of {','.join(BENCHMARKS)}")
+    parser.add_argument('--rate', type=int, default=0, help='bytes per second per connection of the media server, 0 for unlimited')
+    parser.add_argument('--workers', type=parse_list, default=[1, 2, 4], help='worker counts of the queue benchmark')
+    parser.add_argument('--jobs', type=int, default=8, help='downloads per queue benchmark')
+    parser.add_argument('--max-decode-length', type=int, default=600, help='longest fixture trimmed sample accurately')
+    parser.add_argument('--view-seconds', type=float, default=10.0, help='how long the idle view is measured')
+    parser.add_argument('--compare', help='earlier results to compare with, exits with 1 on a regression')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='relative change that counts as a regression')
+    args = parser.parse_args(argv)
+
+    if shutil.which('ffmpeg') is None:
+        print(f'{parser.prog}: error: ffmpeg is needed for the benchmarks', file=sys.stderr)
+        return 2
+
+    args.fixtures_dir = os.path.abspath(args.fixtures_dir)
+    current = {'version': RESULTS_VERSION, 'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+               'environment': environment(), 'results': run(args)}
+    with open(args.output, 'w') as f:
+        json.dump(current, f, indent=2)
+    print(f'[Benchmark] Results written to {args.output}', file=sys.stderr)
+
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            regressions = compare(json.load(f), current, args.tolerance)
+        for regression in regressions:
+            print(f'[Compare] Regression: {regression}', file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
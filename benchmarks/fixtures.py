@@ -0,0 +1,34 @@
+import os
+import subprocess
+from typing import Dict, List
+
+# Lengths of the generated audio in seconds, from a single song to a long mix
+DEFAULT_LENGTHS = (60, 600, 3600, 10800)
+
+def fixture_path(directory: str, seconds: int, codec: str = 'opus') -> str:
+    extension = {'opus': 'webm', 'mp3': 'mp3', 'aac': 'm4a'}[codec]
+    return os.path.join(directory, f'fixture-{seconds}s-{codec}.{extension}')
+
+def generate_fixture(directory: str, seconds: int, codec: str = 'opus') -> str:
+    # A tone with a second of silence at both ends, encoded like the audio YouTube serves.
+    # Generated once, the files are the same on every run
+    path = fixture_path(directory, seconds, codec)
+    if os.path.exists(path):
+        return path
+    os.makedirs(directory, exist_ok=True)
+
+    encoder = {'opus': ['-c:a', 'libopus', '-b:a', '128k'],
+               'mp3': ['-c:a', 'libmp3lame', '-b:a', '192k'],
+               'aac': ['-c:a', 'aac', '-b:a', '128k']}[codec]
+    source = (f'sine=frequency=440:sample_rate=48000:duration={seconds - 2},'
+              f'adelay=1000:all=1,apad=pad_dur=1,volume=0.5')
+    temp_path = path + '.part' + os.path.splitext(path)[1]
+    process = subprocess.run(['ffmpeg', '-y', '-hide_banner', '-loglevel', 'error', '-f', 'lavfi', '-i', source,
+                              '-ac', '2', *encoder, temp_path], capture_output=True, text=True)
+    if process.returncode != 0:
+        raise RuntimeError(f'ffmpeg could not generate {path}: {process.stderr.strip()}')
+    os.replace(temp_path, path)
+    return path
+
+def generate_fixtures(directory: str, lengths: List[int] = DEFAULT_LENGTHS, codec: str = 'opus') -> Dict[int, str]:
+    return {seconds: generate_fixture(directory, seconds, codec) for seconds in lengths}
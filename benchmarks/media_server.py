@@ -0,0 +1,80 @@
+import os
+import re
+import time
+import threading
+from http import HTTPStatus
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+# Stands in for YouTube's media servers: serves the fixtures with range requests, at a fixed rate per connection
+
+class MediaRequestHandler(SimpleHTTPRequestHandler):
+    block_size = 65536
+
+    def do_GET(self) -> None:
+        path = self.translate_path(self.path)
+        if not os.path.isfile(path):
+            self.send_error(HTTPStatus.NOT_FOUND)
+            return
+
+        size = os.path.getsize(path)
+        start, end = 0, size - 1
+        match = re.match(r'bytes=(\d*)-(\d*)$', self.headers.get('Range', ''))
+        if match and match.group(1):
+            start = int(match.group(1))
+            end = min(int(match.group(2)), end) if match.group(2) else end
+        if start >= size:
+            self.send_error(HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE)
+            return
+
+        self.send_response(HTTPStatus.PARTIAL_CONTENT if match else HTTPStatus.OK)
+        self.send_header('Content-Type', self.guess_type(path))
+        self.send_header('Content-Length', str(end - start + 1))
+        self.send_header('Accept-Ranges', 'bytes')
+        if match:
+            self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+        self.end_headers()
+
+        rate = self.server.rate
+        began = time.perf_counter()
+        sent = 0
+        with open(path, 'rb') as f:
+            f.seek(start)
+            while sent < end - start + 1:
+                block = f.read(min(self.block_size, end - start + 1 - sent))
+                if not block:
+                    break
+                try:
+                    self.wfile.write(block)
+                except (BrokenPipeError, ConnectionResetError):
+                    return
+                sent += len(block)
+                if rate:
+                    # Sleeps until the bytes sent so far are due at the configured rate
+                    delay = sent / rate - (time.perf_counter() - began)
+                    if delay > 0:
+                        time.sleep(delay)
+
+    def log_message(self, format: str, *args) -> None:
+        pass
+
+class MediaServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, directory: str, rate: int = 0, address: str = '127.0.0.1', port: int = 0) -> None:
+        handler = lambda *args, **kwargs: MediaRequestHandler(*args, directory=directory, **kwargs)
+        super().__init__((address, port), handler)
+        # Bytes per second per connection, 0 means as fast as possible
+        self.rate: int = rate
+        self.__thread: threading.Thread | None = None
+
+    def url(self, filepath: str) -> str:
+        return f'http://{self.server_address[0]}:{self.server_address[1]}/{os.path.basename(filepath)}'
+
+    def start(self) -> 'MediaServer':
+        self.__thread = threading.Thread(target=self.serve_forever, daemon=True, name='media-server')
+        self.__thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,163 @@
+import sys
+import json
+import time
+import argparse
+import threading
+import contextlib
+from typing import Dict, List, TextIO, Tuple
+from utils.utils import parse_index_ranges, parse_timestamp
+
+# Heavy modules (yt_dlp, pydub, the controller itself) are only imported once there is work to do
+
+EXIT_OK = 0
+EXIT_FAILED = 1
+EXIT_USAGE = 2
+EXIT_INTERRUPTED = 130
+
+class JsonLinesReporter:
+    def __init__(self, stream: TextIO, interval: float = 1.0) -> None:
+        self.stream: TextIO = stream
+        # Progress of a job is written at most once per interval, state changes always are
+        self.interval: float = interval
+        self.__last_report: Dict[int, Tuple[str, float]] = {}
+        self.__lock = threading.Lock()
+
+    def __call__(self, job) -> None:
+        if job is None:
+            return
+
+        now = time.monotonic()
+        with self.__lock:
+            last_state, last_time = self.__last_report.get(job.id, (None, 0.0))
+            if job.state.name == last_state and now - last_time < self.interval:
+                return
+            self.__last_report[job.id] = (job.state.name, now)
+            self.write({'event': 'job', **job.to_dict()})
+
+    def write(self, event: Dict[str, any]) -> None:
+        self.stream.write(json.dumps(event, default=str) + '\n')
+        self.stream.flush()
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog='mp3-yt-downloader',
+                                     description='Download and trim audio from YouTube videos without the GUI. '
+                                                 'Progress is written to stdout as JSON lines.')
+    parser.add_argument('urls', nargs='*', help='URLs to download')
+    parser.add_argument('-i', '--input', help='file with one URL per line, "-" reads them from stdin')
+    parser.add_argument('-o', '--output-dir', help='directory to save files in (defaults to the configured default save directory)')
+    parser.add_argument('-n', '--name', default='', help='custom file name, only valid for a single URL')
+    parser.add_argument('--start', type=parse_timestamp, default=[0, 0, 0], help='trim start as hh:mm:ss')
+    parser.add_argument('--end', type=parse_timestamp, default=[0, 0, 0], help='trim end as hh:mm:ss')
+    parser.add_argument('--profile', help='quality profile from the config, e.g. mp3-320, opus, m4a or flac')
+    parser.add_argument('--split-chapters', action='store_true', help='also split every download into one file per chapter')
+    parser.add_argument('--playlist', action='store_true', help='download every entry of playlist and channel URLs')
+    parser.add_argument('--trim-skip', default='', help='playlist entries not to trim, e.g. "1, 4, 7-9"')
+    parser.add_argument('--rate-limit', type=int, help='bytes per second shared by all downloads, 0 for unlimited')
+    parser.add_argument('--stream', action='store_true', help='transcode while downloading instead of after the download')
+    parser.add_argument('-w', '--workers', type=int, help='number of parallel downloads')
+    parser.add_argument('--cprofile', action='store_true', help='run the downloads under cProfile, see .config/mp3_yt_downloader/profiles')
+    parser.add_argument('--store-gc', action='store_true', help='remove files from the content store that no save directory links to')
+    parser.add_argument('--resume', action='store_true', help='also resume the jobs an earlier run did not finish')
+    return parser
+
+def read_urls(args: argparse.Namespace) -> List[str]:
+    urls = list(args.urls)
+    if args.input:
+        with contextlib.nullcontext(sys.stdin) if args.input == '-' else open(args.input, 'r') as f:
+            urls += [line.strip() for line in f if line.strip() and not line.lstrip().startswith('#')]
+    return urls
+
+def main(argv: List[str] | None = None) -> int:
+    parser = build_parser()
+    args = parser.parse_args(argv)
+
+    try:
+        urls = read_urls(args)
+        trim_skip = parse_index_ranges(args.trim_skip)
+    except (OSError, ValueError) as e:
+        parser.print_usage(sys.stderr)
+        print(f'{parser.prog}: error: {e}', file=sys.stderr)
+        return EXIT_USAGE
+    if not urls and not args.resume and not args.store_gc:
+        return EXIT_OK
+    if args.name and len(urls) > 1:
+        parser.print_usage(sys.stderr)
+        print(f'{parser.prog}: error: --name can only be used with a single URL', file=sys.stderr)
+        return EXIT_USAGE
+    if args.workers is not None and args.workers < 1:
+        parser.print_usage(sys.stderr)
+        print(f'{parser.prog}: error: --workers must be at least 1', file=sys.stderr)
+        return EXIT_USAGE
+
+    from controller.controller import Controller
+
+    trim_timestamps = {'start': args.start, 'end': args.end}
+    try:
+        Controller.validate_trim_timestamps(trim_timestamps)
+    except ValueError as e:
+        parser.print_usage(sys.stderr)
+        print(f'{parser.prog}: error: {e}', file=sys.stderr)
+        return EXIT_USAGE
+
+    reporter = JsonLinesReporter(sys.stdout)
+    jobs = []
+    failed_urls = []
+
+    # Anything else printed while downloading goes to stderr, stdout only carries the JSON lines
+    with contextlib.redirect_stdout(sys.stderr):
+        controller = Controller()
+        if args.workers is not None:
+            controller.max_workers = args.workers
+        if args.output_dir:
+            controller.save_dir = args.output_dir
+        if args.rate_limit is not None:
+            controller.bandwidth.rate_limit = args.rate_limit
+        controller.ydl_opts.update({'quiet': True, 'noprogress': True})
+        if args.profile:
+            try:
+                controller.apply_quality_profile(args.profile)
+            except ValueError as e:
+                parser.print_usage(sys.stderr)
+                print(f'{parser.prog}: error: {e}', file=sys.stderr)
+                return EXIT_USAGE
+        controller.split_chapters = args.split_chapters
+        if args.stream:
+            controller.streaming = True
+        controller.add_listener(reporter)
+
+        try:
+            if args.store_gc:
+                reporter.write({'event': 'store_gc', **controller.collect_store_garbage()})
+            if args.resume:
+                jobs += controller.resume_jobs()
+            for url in urls:
+                if args.playlist:
+                    try:
+                        jobs += controller.download_playlist(url, trim_timestamps, trim_skip)
+                    except Exception as e:
+                        failed_urls.append(url)
+                        reporter.write({'event': 'error', 'url': url, 'error': str(e)})
+                else:
+                    job = controller.create_job(url, args.name, trim_timestamps, split_chapters=args.split_chapters)
+                    job.profile = args.cprofile
+                    jobs.append(controller.submit(job))
+            controller.wait(jobs)
+        except KeyboardInterrupt:
+            controller.shutdown(wait=False, cancel_pending=True)
+            return EXIT_INTERRUPTED
+        controller.shutdown()
+
+    states = [job.state for job in jobs]
+    failed = states.count(Controller.State.ERROR) + len(failed_urls)
+    reporter.write({
+        'event': 'summary',
+        'total': len(jobs) + len(failed_urls),
+        'done': states.count(Controller.State.DONE),
+        'skipped': states.count(Controller.State.SKIPPED),
+        'failed': failed,
+    })
+
+    return EXIT_FAILED if failed else EXIT_OK
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,69 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from typing import Dict, List
+
+class DownloadArchive:
+    def __init__(self, path: str) -> None:
+        self.path: str = path
+        self.__lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        # A single connection is shared by all download workers, access goes through the lock
+        self.__connection = sqlite3.connect(self.path, check_same_thread=False)
+        with self.__lock, self.__connection:
+            self.__connection.execute('''
+                CREATE TABLE IF NOT EXISTS downloads (
+                    archive_id TEXT NOT NULL,
+                    format TEXT NOT NULL,
+                    quality TEXT NOT NULL,
+                    trim TEXT NOT NULL,
+                    path TEXT NOT NULL,
+                    sha256 TEXT NOT NULL,
+                    created REAL NOT NULL,
+                    PRIMARY KEY (archive_id, format, quality, trim)
+                )''')
+            self.__connection.execute('''
+                CREATE TABLE IF NOT EXISTS loudness (
+                    key TEXT PRIMARY KEY,
+                    measurement TEXT NOT NULL
+                )''')
+
+    def lookup(self, archive_id: str, format: str, quality: str, trim: str) -> str | None:
+        with self.__lock:
+            row = self.__connection.execute(
+                'SELECT path FROM downloads WHERE archive_id = ? AND format = ? AND quality = ? AND trim = ?',
+                (archive_id, format, quality, trim)).fetchone()
+        # Files deleted by the user since then have to be downloaded again
+        if row is None or not os.path.exists(row[0]):
+            return None
+        return row[0]
+
+    def lookup_id(self, archive_id: str) -> List[Dict[str, any]]:
+        with self.__lock:
+            rows = self.__connection.execute(
+                'SELECT format, quality, trim, path, sha256, created FROM downloads WHERE archive_id = ?',
+                (archive_id,)).fetchall()
+        return [{'format': format, 'quality': quality, 'trim': trim, 'path': path, 'sha256': sha256, 'created': created}
+                for format, quality, trim, path, sha256, created in rows]
+
+    def add(self, archive_id: str, format: str, quality: str, trim: str, path: str, sha256: str) -> None:
+        with self.__lock, self.__connection:
+            self.__connection.execute(
+                'INSERT OR REPLACE INTO downloads VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (archive_id, format, quality, trim, path, sha256, time.time()))
+
+    def get_loudness(self, key: str) -> Dict[str, str] | None:
+        with self.__lock:
+            row = self.__connection.execute('SELECT measurement FROM loudness WHERE key = ?', (key,)).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def set_loudness(self, key: str, measurement: Dict[str, str]) -> None:
+        with self.__lock, self.__connection:
+            self.__connection.execute('INSERT OR REPLACE INTO loudness VALUES (?, ?)', (key, json.dumps(measurement)))
+
+    def close(self) -> None:
+        with self.__lock:
+            self.__connection.close()
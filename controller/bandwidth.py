@@ -0,0 +1,65 @@
+import datetime
+import threading
+from typing import Dict, List
+
+class BandwidthScheduler:
+    # Share of the budget per priority, an interactive download gets four times the bandwidth of a batch download
+    PRIORITY_WEIGHTS = (1, 4)
+
+    def __init__(self, rate_limit: int = 0, profiles: List[Dict[str, any]] | None = None) -> None:
+        # Bytes per second across all downloads, 0 means unlimited
+        self.rate_limit: int = rate_limit
+        # Time of day overrides, {'start': 'hh:mm', 'end': 'hh:mm', 'rate_limit': bytes per second}
+        self.profiles: List[Dict[str, any]] = profiles or []
+        # yt_dlp's downloaders read 'ratelimit' from these params for every chunk, so changing it
+        # throttles a download that is already running
+        self.__active: Dict[int, Dict[str, any]] = {}
+        self.__limit: int | None = None
+        self.__lock = threading.Lock()
+
+    @staticmethod
+    def parse_time(time: str) -> datetime.time:
+        hours, minutes = time.split(':')
+        return datetime.time(int(hours), int(minutes))
+
+    def current_limit(self, now: datetime.datetime | None = None) -> int:
+        now = (now or datetime.datetime.now()).time()
+        for profile in self.profiles:
+            start, end = self.parse_time(profile['start']), self.parse_time(profile['end'])
+            # A profile can span midnight, e.g. 22:00 to 06:00
+            if start <= now < end if start <= end else (now >= start or now < end):
+                return profile['rate_limit']
+        return self.rate_limit
+
+    def register(self, job_id: int, params: Dict[str, any], priority: int = 0) -> None:
+        with self.__lock:
+            self.__active[job_id] = {'params': params, 'priority': priority}
+            self.__rebalance()
+
+    def unregister(self, job_id: int) -> None:
+        with self.__lock:
+            entry = self.__active.pop(job_id, None)
+            if entry is not None:
+                entry['params'].pop('ratelimit', None)
+            self.__rebalance()
+
+    def tick(self) -> None:
+        # Called on download progress, only redistributes once a time of day profile starts or ends
+        if self.current_limit() != self.__limit:
+            with self.__lock:
+                self.__rebalance()
+
+    def allocation(self, job_id: int) -> int | None:
+        entry = self.__active.get(job_id)
+        return entry['params'].get('ratelimit') if entry is not None else None
+
+    def __rebalance(self) -> None:
+        self.__limit = self.current_limit()
+        weights = {job_id: self.PRIORITY_WEIGHTS[min(max(entry['priority'], 0), len(self.PRIORITY_WEIGHTS) - 1)]
+                   for job_id, entry in self.__active.items()}
+        total = sum(weights.values())
+        for job_id, entry in self.__active.items():
+            if self.__limit:
+                entry['params']['ratelimit'] = max(self.__limit * weights[job_id] // total, 1)
+            else:
+                entry['params'].pop('ratelimit', None)
@@ -1,25 +1,38 @@
-import yt_dlp
 import os
 import json
-from pydub import AudioSegment
-from utils.utils import get_time_milliseconds
-from typing import Dict, List
-from random import randint
-from enum import Enum
+import time
+import tempfile
+import cProfile
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from controller.archive import DownloadArchive
+from controller.bandwidth import BandwidthScheduler
+from controller.job import DownloadJob
+from controller.job_store import JobStore
+from controller.library import LibraryIndex, LibraryWatcher, read_metadata
+from controller.metadata import MetadataCache
+from controller.metrics import MetricsRecorder
+from controller.silence import detect_audio_bounds
+from controller.playlist import PlaylistProgress
+from controller.session import SessionPool
+from controller.store import ContentStore
+from controller.streaming import is_streamable, stream_transcode
+from controller.tags import COVER_EXTENSIONS, ThumbnailCache, extract_cover, get_metadata_args
+from controller.waveform import WaveformPeaks
+from controller.trim import (batch_split, chapters_to_segments, ffmpeg_available, get_audio_duration, get_export_format,
+                             split_file, trim_stream_copy)
+from controller.state import State
+from utils.utils import get_file_hash, get_time_milliseconds, get_timestamp
+from typing import Callable, Dict, Iterable, List, Set
 
 class Controller:
-    @staticmethod
-    class State(Enum):
-            IDLE = 0
-            REQUEST = 1
-            DOWNLOADING = 2
-            POSTPROCESSING = 3
-            DONE = 4
-            TRIMMED = 5
-            SAVE_DIR_CHANGED = 6
-            ERROR = 7
+    State = State
+    # Codecs FFmpegExtractAudio can convert to
+    CODECS = ('mp3', 'aac', 'm4a', 'opus', 'vorbis', 'flac', 'alac', 'wav')
 
     def __init__(self) -> None:
+        # Observers notified on every state or progress change, with the job that changed (None for the controller itself)
+        self.__listeners: List[Callable[[DownloadJob | None], None]] = []
         self.ydl_opts: Dict[any] = {
             'format': 'mp3/bestaudio/best',
             'postprocessors': [{  
@@ -28,126 +41,860 @@ class Controller:
                 'preferredquality': '192'
             }],
             'noplaylist': True,
-            'progress_hooks': [self.__progress_hook]
+            # Partial .part files are resumed, see run_job for the deterministic filenames
+            'continuedl': True,
+            'retries': 10,
+            'fragment_retries': 10,
+            # Fragmented (DASH/HLS) formats are fetched over several connections at once
+            'concurrent_fragment_downloads': 4,
+            # Fetching in chunks means a dropped connection only loses the current chunk
+            'http_chunk_size': 10485760
         }
         self.url: str = ''
         self.__config_dir: str = os.path.join('.config', 'mp3_yt_downloader')
         self.__config_path: str = os.path.join(self.__config_dir, 'config.json') 
+        self.__playlists_dir: str = os.path.join(self.__config_dir, 'playlists')
+        self.__archive_path: str = os.path.join(self.__config_dir, 'archive.sqlite3')
+        self.__library_path: str = os.path.join(self.__config_dir, 'library.sqlite3')
+        self.__thumbnails_dir: str = os.path.join(self.__config_dir, 'thumbnails')
+        self.__jobs_dir: str = os.path.join(self.__config_dir, 'jobs')
+        self.__profiles_dir: str = os.path.join(self.__config_dir, 'profiles')
         self.__default_save_dir_name: str = 'mp3_yt_downloads'
         self.default_save_dir: str = os.path.join(os.getcwd(), self.__default_save_dir_name)
         self.save_dir: str = ''
         self.custom_filename: str = ''
-        self.save_filename: str = ''
         self.trim_filepath: str = ''
+        self.split_filepaths: List[str] = []
         self.trim_timestamps: Dict[List[int | float]] = {'start': [0, 0, 0], 'end': [0, 0, 0]}
         self.trimmed_download: bool = False
+        # Decodes and re-encodes with pydub instead of cutting on frame boundaries
+        self.sample_accurate_trim: bool = False
+        # Only fetches the trimmed section instead of trimming after the download
+        self.download_sections: bool = True
+        # Automatic trim: everything quieter than the threshold (dBFS) at the start and end is cut,
+        # leaving the padding (milliseconds) around the audio
+        self.silence_threshold: float = -50.0
+        self.silence_padding: int = 200
+        # Two pass EBU R128 loudness normalization in the audio transcode, measurements are cached in the archive
+        self.normalize_loudness: bool = False
+        self.loudness_target: Dict[str, float] = {'I': -16.0, 'TP': -1.5, 'LRA': 11.0}
+        # Tags and the video's thumbnail as cover art are written by the transcode itself, see
+        # postprocessors.TaggingExtractAudioPP. Thumbnails are cached per video up to the cache size (bytes)
+        self.embed_metadata: bool = True
+        self.thumbnail_cache_size: int = 256 * 1024 * 1024
+        self.__thumbnails: ThumbnailCache | None = None
+        # Transcodes (and trims) while downloading instead of after, single file formats over HTTP only
+        self.streaming: bool = False
         self.download_status: Dict[any] = {'progress': '', 'eta': '', 'speed': '', 
-                                            'file_size': '', 'elapsed_time': ''}
-        self.state: int = Controller.State.IDLE
+                                            'file_size': '', 'elapsed_time': '',
+                                            'throughput': '', 'rate_limit': '', 'transcode_progress': ''}
+        self.__state: State = Controller.State.IDLE
         self.error_message: str = ''
 
+        # Playlist and channel batch mode
+        self.playlist_mode: bool = False
+        self.playlist_trim_skip: Set[int] = set()
+        self.playlist_filename_template: str = '%(playlist_index)03d - %(title)s'
+
+        # Splits downloads into one file per chapter of the video
+        self.split_chapters: bool = False
+
+        # Download queue, every job runs on its own worker with its own YoutubeDL instance
+        self.max_workers: int = 4
+        self.jobs: List[DownloadJob] = []
+        self.current_job: DownloadJob | None = None
+        self.__executor: ThreadPoolExecutor | None = None
+        self.__jobs_lock = threading.Lock()
+        # YoutubeDL instances are kept between jobs instead of being set up for every download
+        self.sessions: SessionPool = SessionPool(self.create_ydl, self.max_workers, self.get_session_settings)
+
+        # Timing, throughput and CPU time of every job phase, see metrics.MetricsRecorder
+        self.metrics: MetricsRecorder = MetricsRecorder(os.path.join(self.__config_dir, 'metrics.jsonl'),
+                                                        os.path.join(self.__config_dir, 'metrics.prom'))
+
+        # Global bandwidth budget shared by all running downloads, weighted by job priority
+        self.bandwidth: BandwidthScheduler = BandwidthScheduler()
+
+        # Metadata is fetched in the background as soon as a URL is known, downloads reuse it
+        self.metadata_cache: MetadataCache = MetadataCache()
+        self.__metadata_executor: ThreadPoolExecutor | None = None
+
+        # Unfinished jobs are persisted so they can be resumed after a crash or restart
+        self.default_filename: str = '%(title)s [%(id)s]'
+        self.max_attempts: int = 3
+        self.job_store: JobStore = JobStore(self.__jobs_dir)
+        # Off where jobs are persisted elsewhere, like the spool of a worker
+        self.persist_jobs: bool = True
+
+        # Output profiles, the format prefers sources that already have the profile's codec so
+        # FFmpegExtractAudio only remuxes them instead of transcoding
+        self.quality_profiles: Dict[str, Dict[str, str]] = {
+            'mp3-192': {'format': 'mp3/bestaudio/best', 'codec': 'mp3', 'quality': '192'},
+            'mp3-320': {'format': 'mp3/bestaudio/best', 'codec': 'mp3', 'quality': '320'},
+            'opus': {'format': 'bestaudio[acodec=opus]/bestaudio/best', 'codec': 'opus', 'quality': '160'},
+            'm4a': {'format': 'bestaudio[acodec^=mp4a]/bestaudio[ext=m4a]/bestaudio/best', 'codec': 'm4a', 'quality': '192'},
+            'flac': {'format': 'bestaudio/best', 'codec': 'flac', 'quality': ''},
+        }
+        self.quality_profile: str = 'mp3-192'
+
+        # Index of finished downloads, used to skip videos that are already on disk
+        self.use_archive: bool = True
+        self.__archive: DownloadArchive | None = None
+
+        # Content addressed store, finished files are kept once and linked into the save directories.
+        # Only saves space when the store is on the same file system as the save directories
+        self.use_store: bool = False
+        self.store_dir: str = os.path.join(self.__config_dir, 'store')
+        self.__store: ContentStore | None = None
+
+        # Index of every audio file in the save directories, see library.LibraryIndex. The watcher keeps it
+        # current while the GUI runs, with a full stat diff every scan interval (seconds, 0 for never)
+        self.library_scan_interval: int = 300
+        self.__library: LibraryIndex | None = None
+        self.__library_watcher: LibraryWatcher | None = None
+
         # Loads config from file
         self.load_config()
+        self.apply_quality_profile(self.quality_profile)
+
+    @property
+    def state(self) -> State:
+        return self.__state
+
+    @state.setter
+    def state(self, state: State) -> None:
+        self.__state = state
+        self.__notify(None)
+
+    def add_listener(self, listener: Callable[[DownloadJob | None], None]) -> None:
+        self.__listeners.append(listener)
+
+    def remove_listener(self, listener: Callable[[DownloadJob | None], None]) -> None:
+        self.__listeners.remove(listener)
+
+    def __notify(self, job: DownloadJob | None) -> None:
+        # Listeners are called from the worker threads, they must not block
+        for listener in list(self.__listeners):
+            listener(job)
 
     @property
     def save_path(self) -> str:
-        return os.path.join(self.save_dir, self.save_filename)
-    
-    def download(self) -> None:
+        return self.current_job.save_path if self.current_job else ''
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        if self.__executor is None:
+            # Every worker can keep its session
+            self.sessions.max_idle = self.max_workers
+            self.__executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='download')
+        return self.__executor
+
+    @property
+    def metadata_executor(self) -> ThreadPoolExecutor:
+        # Separate from the download workers so a prefetch never waits behind the queue
+        if self.__metadata_executor is None:
+            self.__metadata_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='metadata')
+        return self.__metadata_executor
+
+    @property
+    def archive(self) -> DownloadArchive:
+        if self.__archive is None:
+            self.__archive = DownloadArchive(self.__archive_path)
+        return self.__archive
+
+    @property
+    def thumbnails(self) -> ThumbnailCache:
+        if self.__thumbnails is None:
+            self.__thumbnails = ThumbnailCache(self.__thumbnails_dir, self.thumbnail_cache_size)
+        self.__thumbnails.max_bytes = self.thumbnail_cache_size
+        return self.__thumbnails
+
+    @property
+    def library(self) -> LibraryIndex:
+        if self.__library is None:
+            self.__library = LibraryIndex(self.__library_path)
+        return self.__library
+
+    @property
+    def library_roots(self) -> List[str]:
+        roots = [os.path.abspath(path) for path in (self.default_save_dir, self.save_dir) if path]
+        return list(dict.fromkeys(roots))
+
+    def watch_library(self) -> None:
+        # (Re)started whenever the save directories change
+        if self.__library_watcher is not None:
+            if self.__library_watcher.roots == self.library_roots:
+                return
+            self.__library_watcher.stop(wait=False)
+        self.__library_watcher = LibraryWatcher(self.library, self.library_roots, self.library_scan_interval).start()
+
+    def scan_library(self) -> Dict[str, int]:
+        counts = {'added': 0, 'updated': 0, 'removed': 0}
+        for root in self.library_roots:
+            for key, count in self.library.scan(root).items():
+                counts[key] += count
+        return counts
+
+    def search_library(self, text: str = '', limit: int = 100) -> List[Dict[str, any]]:
+        return self.library.search(text, self.library_roots, limit)
+
+    def latest_download(self) -> str | None:
+        # Newest file of the save directories, without listing them
+        return self.library.latest(self.library_roots)
+
+    def __index_job(self, job: DownloadJob, output_path: str) -> None:
+        # The downloader knows the source of the file, the watcher would only guess it from the name
+        for path in [output_path, *job.split_filepaths]:
+            try:
+                self.library.add(path, job.video_id or None, job.title or None)
+            except FileNotFoundError:
+                pass
+
+    @property
+    def store(self) -> ContentStore:
+        if self.__store is None or self.__store.directory != self.store_dir:
+            self.__store = ContentStore(self.store_dir)
+        return self.__store
+
+    def store_key(self, job: DownloadJob) -> str:
+        return ContentStore.key(job.archive_id, *self.archive_key(job))
+
+    def collect_store_garbage(self) -> Dict[str, int]:
+        # Removes stored files that are not linked from any save directory anymore
+        return self.store.collect_garbage()
+
+    @staticmethod
+    def get_archive_id(url: str) -> str:
+        # yt_dlp and pydub are imported where they are used, so the CLI starts without loading them
+        import yt_dlp
+        # Only matches the url against the extractors, no request is made
+        for ie in yt_dlp.extractor.gen_extractor_classes():
+            if ie.suitable(url):
+                video_id = ie.get_temp_id(url)
+                return f'{ie.ie_key().lower()} {video_id}' if video_id else ''
+        return ''
+
+    def archive_key(self, job: DownloadJob) -> List[str]:
+        audio_pp = self.ydl_opts['postprocessors'][0]
+        if self.validate_trim_timestamps(job.trim_timestamps):
+            trim = f"{get_time_milliseconds(job.trim_timestamps['start'])}-{get_time_milliseconds(job.trim_timestamps['end'])}"
+        else:
+            trim = ''
+        # A normalized download is a different file than the original one
+        quality = audio_pp['preferredquality'] + (' loudnorm' if self.normalize_loudness else '')
+        return [job.codec or audio_pp['preferredcodec'], quality, trim]
+
+    def download(self) -> DownloadJob | None:
         if self.url == '':
             self.error_message = 'No URL provided! >:('
             self.state = Controller.State.ERROR
             return
-        
-        self.state = Controller.State.REQUEST
-        with yt_dlp.YoutubeDL(self.ydl_opts) as ydl:
-            if self.save_dir == '':
-                os.makedirs(self.__default_save_dir_name, exist_ok=True)
-                self.save_dir = self.default_save_dir
 
-            if self.custom_filename == '':
-                self.save_filename = f'%(title)s_{randint(0, 1000)}'
-            else:
-                self.save_filename = self.custom_filename
-        
-            self.ydl_opts['outtmpl']['default'] = self.save_path
+        # Fails before queueing instead of after the whole download
+        try:
+            self.validate_trim_timestamps(self.trim_timestamps)
+        except ValueError as e:
+            self.error_message = str(e)
+            self.state = Controller.State.ERROR
+            raise
 
+        # A prefetched duration lets invalid trims fail before anything is queued
+        info = self.cached_metadata(self.url)
+        if info is not None:
             try:
-                ydl.download([self.url])
-                if self.should_trim:
-                    self.trim_audio_file(self.save_path)
-                self.state = Controller.State.DONE
-                self.reset_file_settings()
-            except yt_dlp.utils.DownloadError as e:
-                self.error_message = e.exc_info[1]
+                self.validate_trim_duration(self.trim_timestamps, info)
+            except ValueError as e:
+                self.error_message = str(e)
                 self.state = Controller.State.ERROR
                 raise
-    
+
+        if self.playlist_mode:
+            jobs = self.download_playlist(self.url, self.trim_timestamps, self.playlist_trim_skip)
+            self.reset_file_settings()
+            return jobs
+
+        job = self.create_job(self.url, self.custom_filename, self.trim_timestamps, split_chapters=self.split_chapters,
+                              priority=DownloadJob.PRIORITY_INTERACTIVE)
+        self.reset_file_settings()
+        return self.submit(job)
+
+    def metadata_key(self, url: str) -> str:
+        return self.get_archive_id(url) or url
+
+    def cached_metadata(self, url: str) -> Dict[str, any] | None:
+        return self.metadata_cache.get(self.metadata_key(url))
+
+    def fetch_metadata(self, url: str) -> Dict[str, any]:
+        key = self.metadata_key(url)
+        info = self.metadata_cache.get(key)
+        if info is None:
+            # Unprocessed, so the download picks its formats with its own options. The extraction
+            # runs on a pooled session, which the download can reuse as well
+            with self.sessions.session(dict(self.ydl_opts)) as ydl:
+                info = ydl.extract_info(url, download=False, process=False)
+            self.metadata_cache.put(key, info)
+            info = self.metadata_cache.get(key)
+        return info
+
+    def prefetch_metadata(self, url: str) -> Future:
+        # Starts the extraction while the rest of the form is filled in, see fetch_metadata
+        return self.metadata_executor.submit(self.fetch_metadata, url)
+
+    def extract_playlist(self, url: str) -> Dict[str, any]:
+        import yt_dlp
+        # Flat extraction only resolves the entries' ids and titles, not their formats
+        opts = {'extract_flat': 'in_playlist', 'quiet': True, 'noplaylist': False}
+        with yt_dlp.YoutubeDL(opts) as ydl:
+            info = ydl.extract_info(url, download=False)
+            entries = list(self.__flatten_entries(info.get('entries') or [info]))
+            for index, entry in enumerate(entries, start=1):
+                entry_info = {**entry,
+                              'playlist_index': index,
+                              'playlist_count': len(entries),
+                              'playlist_id': info.get('id'),
+                              'playlist_title': info.get('title')}
+                entry['filename'] = ydl.evaluate_outtmpl(self.playlist_filename_template, entry_info, sanitize=True)
+        info['entries'] = entries
+        return info
+
+    def __flatten_entries(self, entries: Iterable[Dict[str, any]]) -> Iterable[Dict[str, any]]:
+        # Channels come back as playlists of playlists (one per tab)
+        for entry in entries:
+            if entry is None:
+                continue
+            if entry.get('entries') is not None:
+                yield from self.__flatten_entries(entry['entries'])
+            else:
+                yield entry
+
+    def download_playlist(self, url: str, trim_timestamps: Dict[str, List[int | float]] | None = None,
+                          trim_skip: Set[int] = frozenset()) -> List[DownloadJob]:
+        import yt_dlp
+        self.state = Controller.State.REQUEST
+        try:
+            info = self.extract_playlist(url)
+        except yt_dlp.utils.DownloadError as e:
+            self.error_message = e.exc_info[1]
+            self.state = Controller.State.ERROR
+            raise
+
+        # Entries finished in a previous run are not downloaded again
+        progress = PlaylistProgress(os.path.join(self.__playlists_dir, f"{info.get('id', 'playlist')}.json"))
+
+        jobs = []
+        for index, entry in enumerate(info['entries'], start=1):
+            if progress.is_completed(entry['id']):
+                continue
+            entry_trim = None if index in trim_skip else trim_timestamps
+            job = self.create_job(entry.get('url') or entry.get('webpage_url'), entry['filename'], entry_trim,
+                                  split_chapters=self.split_chapters)
+            job.video_id = entry['id']
+            job.archive_id = f"{entry['ie_key'].lower()} {entry['id']}" if entry.get('ie_key') else ''
+            job.playlist_index = index
+            self.submit(job)
+            job.future.add_done_callback(lambda _, job=job: self.__playlist_entry_done(progress, job))
+            jobs.append(job)
+
+        if not jobs:
+            self.state = Controller.State.DONE
+        return jobs
+
+    def __playlist_entry_done(self, progress: PlaylistProgress, job: DownloadJob) -> None:
+        if job.state in (Controller.State.DONE, Controller.State.SKIPPED):
+            progress.mark_completed(job.video_id, job.save_path)
+
+    def create_job(self, url: str, custom_filename: str = '',
+                   trim_timestamps: Dict[str, List[int | float]] | None = None, codec: str = '',
+                   split_chapters: bool = False, priority: int = DownloadJob.PRIORITY_BACKGROUND) -> DownloadJob:
+        if codec != '' and codec not in Controller.CODECS:
+            raise ValueError(f'Unsupported codec {codec}! >:(')
+        save_dir = self.save_dir if self.save_dir != '' else self.default_save_dir
+        trim_timestamps = {point: list(time) for point, time in trim_timestamps.items()} if trim_timestamps else None
+        job = DownloadJob(url, save_dir, custom_filename, trim_timestamps)
+        job.codec = codec
+        job.split_chapters = split_chapters
+        job.priority = priority
+        return job
+
+    def get_job(self, job_id: int) -> DownloadJob | None:
+        with self.__jobs_lock:
+            return next((job for job in self.jobs if job.id == job_id), None)
+
+    @property
+    def pending_jobs(self) -> int:
+        with self.__jobs_lock:
+            return sum(1 for job in self.jobs if not job.finished)
+
+    def submit(self, job: DownloadJob) -> DownloadJob:
+        with self.__jobs_lock:
+            self.jobs.append(job)
+        if self.persist_jobs:
+            self.job_store.save(job)
+        job.future = self.executor.submit(self.run_job, job)
+        return job
+
+    def resume_jobs(self) -> List[DownloadJob]:
+        jobs = []
+        for state in self.job_store.load_all():
+            job = DownloadJob.from_state(state)
+            if job.attempts >= self.max_attempts:
+                self.job_store.remove(job)
+                continue
+            jobs.append(self.submit(job))
+        return jobs
+
+    def wait(self, jobs: List[DownloadJob] | None = None) -> None:
+        for job in list(self.jobs if jobs is None else jobs):
+            if job.future is not None:
+                # Errors are already recorded on the job itself
+                job.future.exception()
+
+    def clear_finished_jobs(self, max_age: float = 0) -> None:
+        # Jobs finished less than max_age seconds ago are kept
+        cutoff = time.time() - max_age
+        with self.__jobs_lock:
+            self.jobs = [job for job in self.jobs if not job.finished or (job.finished_at or 0) > cutoff]
+
+    def set_max_workers(self, max_workers: int) -> None:
+        if max_workers < 1:
+            raise ValueError('At least one worker is needed! >:(')
+        self.max_workers = max_workers
+        if self.__executor is not None:
+            # Jobs already queued keep running on the old pool
+            self.__executor.shutdown(wait=False)
+            self.__executor = None
+        self.save_config()
+
+    def metrics_text(self) -> str:
+        # Totals of the finished jobs in Prometheus' text format, plus the queue as it is now
+        return self.metrics.prometheus_text({'pending_jobs': self.pending_jobs})
+
+    def apply_quality_profile(self, name: str) -> None:
+        if name not in self.quality_profiles:
+            raise ValueError(f'Unknown quality profile {name}! >:(')
+        profile = self.quality_profiles[name]
+        if profile['codec'] not in Controller.CODECS:
+            raise ValueError(f"Unsupported codec {profile['codec']}! >:(")
+        self.quality_profile = name
+        self.ydl_opts['format'] = profile['format']
+        self.ydl_opts['postprocessors'][0]['preferredcodec'] = profile['codec']
+        self.ydl_opts['postprocessors'][0]['preferredquality'] = profile['quality']
+
+    def set_quality_profile(self, name: str) -> None:
+        self.apply_quality_profile(name)
+        self.save_config()
+
+    def shutdown(self, wait: bool = True, cancel_pending: bool = False) -> None:
+        if self.__executor is not None:
+            self.__executor.shutdown(wait=wait, cancel_futures=cancel_pending)
+            self.__executor = None
+        if self.__metadata_executor is not None:
+            self.__metadata_executor.shutdown(wait=wait, cancel_futures=True)
+            self.__metadata_executor = None
+        if self.__library_watcher is not None:
+            self.__library_watcher.stop(wait)
+            self.__library_watcher = None
+        if wait:
+            self.sessions.close()
+
+    def job_ydl_opts(self, job: DownloadJob) -> Dict[str, any]:
+        import yt_dlp
+        opts = dict(self.ydl_opts)
+        opts['postprocessors'] = [dict(pp) for pp in self.ydl_opts['postprocessors']]
+        if job.codec != '':
+            opts['postprocessors'][0]['preferredcodec'] = job.codec
+        opts['outtmpl'] = {'default': job.save_path}
+        # Lets yt_dlp recognise an already converted file, so an interrupted job resumes after the download
+        opts['final_ext'] = yt_dlp.postprocessor.ffmpeg.ACODECS[opts['postprocessors'][0]['preferredcodec']][0]
+        opts['progress_hooks'] = [lambda d: self.__progress_hook(job, d)]
+        opts['post_hooks'] = [lambda filepath: self.__post_hook(job, filepath)]
+
+        if self.download_sections and self.validate_trim_timestamps(job.trim_timestamps):
+            start = get_time_milliseconds(job.trim_timestamps['start']) / 1000
+            end = get_time_milliseconds(job.trim_timestamps['end']) / 1000
+            # The cut happens while fetching, before FFmpegExtractAudio transcodes anything
+            opts['download_ranges'] = yt_dlp.utils.download_range_func(None, [(start, end if end != 0 else float('inf'))])
+        return opts
+
+    def get_session_settings(self) -> Dict[str, any]:
+        # The settings create_ydl reads besides the options, sessions built with others are not reused
+        return {'normalize_loudness': self.normalize_loudness, 'loudness_target': self.loudness_target,
+                'embed_metadata': self.embed_metadata}
+
+    def create_ydl(self, opts: Dict[str, any]):
+        import yt_dlp
+        if not self.normalize_loudness and not self.embed_metadata:
+            return yt_dlp.YoutubeDL(opts)
+
+        from controller.postprocessors import LoudnessMeasurePP, TaggingExtractAudioPP
+        # Postprocessors from the options always run before added ones, but the measurement has to run
+        # before FFmpegExtractAudio, so the whole chain is added here in order
+        postprocessors = [dict(pp) for pp in opts.pop('postprocessors')]
+        ydl = yt_dlp.YoutubeDL(opts)
+        if self.normalize_loudness:
+            ydl.add_post_processor(LoudnessMeasurePP(ydl, self.archive, self.loudness_target,
+                                                     postprocessors[0]['preferredcodec']))
+        for pp in postprocessors:
+            when = pp.pop('when', 'post_process')
+            key = pp.pop('key')
+            if key == 'FFmpegExtractAudio' and self.embed_metadata:
+                ydl.add_post_processor(TaggingExtractAudioPP(ydl, self.thumbnails, **pp), when=when)
+            else:
+                ydl.add_post_processor(yt_dlp.postprocessor.get_postprocessor(key)(ydl, **pp), when=when)
+        return ydl
+
+    def run_job(self, job: DownloadJob) -> DownloadJob:
+        if not job.profile:
+            return self.__run_job(job)
+        # cProfile of this job's worker thread, readable with pstats or snakeviz
+        profiler = cProfile.Profile()
+        try:
+            return profiler.runcall(self.__run_job, job)
+        finally:
+            os.makedirs(self.__profiles_dir, exist_ok=True)
+            profiler.dump_stats(os.path.join(self.__profiles_dir, f'job-{job.id}-{job.key}.prof'))
+
+    def __run_job(self, job: DownloadJob) -> DownloadJob:
+        import yt_dlp
+        self.__set_job_state(job, Controller.State.REQUEST)
+        # Whatever fails, the job ends in ERROR, a job left running would never be finished
+        try:
+            return self.__download_job(job)
+        except yt_dlp.utils.DownloadError as e:
+            job.error_message = e.exc_info[1]
+            self.__set_job_state(job, Controller.State.ERROR)
+            raise
+        except Exception as e:
+            job.error_message = e
+            self.__set_job_state(job, Controller.State.ERROR)
+            raise
+
+    def __download_job(self, job: DownloadJob) -> DownloadJob:
+        os.makedirs(job.save_dir, exist_ok=True)
+
+        if (self.use_archive or self.use_store) and job.archive_id == '':
+            job.archive_id = self.get_archive_id(job.url)
+
+        # The same video with the same profile and trim is only linked into this save directory.
+        # Chapters are only known after a download, so jobs that split them are not linked
+        if self.use_store and job.archive_id and not job.split_chapters:
+            stored = self.store.lookup(self.store_key(job))
+            if stored is not None:
+                stored_path, name = stored
+                job.save_filename = (job.custom_filename or name) + os.path.splitext(stored_path)[1]
+                self.store.link_to(stored_path, job.save_path)
+                if self.use_archive:
+                    self.archive.add(job.archive_id, *self.archive_key(job), job.save_path, get_file_hash(job.save_path))
+                self.__index_job(job, job.save_path)
+                self.__set_job_state(job, Controller.State.DONE)
+                return job
+
+        if self.use_archive:
+            archived_path = self.archive.lookup(job.archive_id, *self.archive_key(job)) if job.archive_id else None
+            if archived_path is not None:
+                job.save_dir, job.save_filename = os.path.split(archived_path)
+                self.__set_job_state(job, Controller.State.SKIPPED)
+                return job
+
+        # Deterministic filenames let yt_dlp find the partial or finished file of an earlier attempt
+        if job.custom_filename == '':
+            job.save_filename = self.default_filename
+        else:
+            job.save_filename = job.custom_filename
+        job.attempts += 1
+
+        # Prefetched videos are not extracted a second time, playlists always are
+        info = self.cached_metadata(job.url)
+        if info is not None and info.get('_type', 'video') == 'video':
+            job.title = info.get('title', '')
+            self.validate_trim_duration(job.trim_timestamps, info)
+        else:
+            info = None
+        opts = self.job_ydl_opts(job)
+        streamed = False
+        with self.sessions.session(opts) as ydl:
+            self.bandwidth.register(job.id, ydl.params, job.priority)
+            try:
+                # The loudness measurement needs the whole download before the transcode starts
+                if self.streaming and not self.normalize_loudness:
+                    if info is None:
+                        info = ydl.extract_info(job.url, download=False, process=False)
+                    if info.get('_type', 'video') == 'video':
+                        info = ydl.process_ie_result(info, download=False)
+                        streamed = self.__stream_job(job, ydl, info, opts)
+                if streamed:
+                    pass
+                elif info is not None:
+                    ydl.process_ie_result(info, download=True)
+                else:
+                    ydl.download([job.url])
+            finally:
+                self.bandwidth.unregister(job.id)
+        # Section downloads and streamed jobs are already trimmed
+        if not streamed and 'download_ranges' not in opts and self.validate_trim_timestamps(job.trim_timestamps):
+            job.trimmed_download = True
+            with self.metrics.phase(job.id, 'trim'):
+                job.trim_filepath = self.trim_file(job.save_path, job.trim_timestamps)
+        output_path = job.trim_filepath if job.trimmed_download else job.save_path
+        if job.split_chapters and job.chapters:
+            # One pass over the downloaded audio for all chapters
+            segments = chapters_to_segments(job.chapters, get_time_milliseconds(job.trim_timestamps['start']),
+                                            get_time_milliseconds(job.trim_timestamps['end']), job.title)
+            if segments:
+                with self.metrics.phase(job.id, 'split'):
+                    job.split_filepaths = split_file(output_path, segments, sample_accurate=self.sample_accurate_trim)
+        if self.use_store and job.archive_id:
+            self.store.add(self.store_key(job), output_path)
+        if self.use_archive and job.archive_id:
+            self.archive.add(job.archive_id, *self.archive_key(job), output_path, get_file_hash(output_path))
+        self.__index_job(job, output_path)
+        self.__set_job_state(job, Controller.State.DONE)
+        return job
+
     @property
     def trim_timestamps_not_set(self) -> bool:
         return self.trim_timestamps['start'] == [0, 0, 0] and self.trim_timestamps['end'] == [0, 0, 0]
     
     @property
     def should_trim(self) -> bool:
-        start = get_time_milliseconds(self.trim_timestamps['start'])
-        end = get_time_milliseconds(self.trim_timestamps['end'])
+        try:
+            return self.validate_trim_timestamps(self.trim_timestamps)
+        except ValueError as e:
+            self.error_message = str(e)
+            self.state = Controller.State.ERROR
+            raise
+
+    @staticmethod
+    def validate_trim_timestamps(trim_timestamps: Dict[str, List[int | float]]) -> bool:
+        start = get_time_milliseconds(trim_timestamps['start'])
+        end = get_time_milliseconds(trim_timestamps['end'])
 
         if end < start:
-            self.error_message = 'End time is before start time! >:('
-            self.state = Controller.State.ERROR
-            raise ValueError(self.error_message)
+            raise ValueError('End time is before start time! >:(')
         if start != 0 and start == end:
-            self.error_message = 'Start and end times are the same! >:('
-            self.state = Controller.State.ERROR
-            raise ValueError(self.error_message)
-        self.trimmed_download = self.state == Controller.State.POSTPROCESSING and end > start
+            raise ValueError('Start and end times are the same! >:(')
 
         return end > start
 
-    def trim_audio_file(self, filepath: str) -> None:
-        time_start = get_time_milliseconds(self.trim_timestamps['start'])
-        time_end = get_time_milliseconds(self.trim_timestamps['end'])
+    @staticmethod
+    def validate_trim_duration(trim_timestamps: Dict[str, List[int | float]] | None, info: Dict[str, any]) -> None:
+        if not trim_timestamps or not info.get('duration'):
+            return
+        if get_time_milliseconds(trim_timestamps['start']) >= info['duration'] * 1000:
+            raise ValueError('Start time greater or equal to audio length! >:(')
 
+    def trim_audio_file(self, filepath: str) -> None:
         try:
-            audio = AudioSegment.from_mp3(filepath)
-        except FileNotFoundError as e:
+            self.trim_filepath = self.trim_file(filepath, self.trim_timestamps)
+        except (FileNotFoundError, ValueError) as e:
             self.error_message = e
             self.state = Controller.State.ERROR
             raise
+        self.state = Controller.State.TRIMMED
 
-        if len(audio) <= time_start:
-            self.error_message = 'Start time greater or equal to audio length! >:('
-            self.state = Controller.State.ERROR
-            raise ValueError(self.error_message)
-        
-        audio = audio[time_start:] if time_end == 0 else audio[time_start:time_end]
+    def trim_file(self, filepath: str, trim_timestamps: Dict[str, List[int | float]]) -> str:
+        time_start = get_time_milliseconds(trim_timestamps['start'])
+        time_end = get_time_milliseconds(trim_timestamps['end'])
 
         directory, file = os.path.split(filepath)
         file_no_extension, extention = os.path.splitext(file)
-        filepath = os.path.join(directory, file_no_extension + '_trimmed' + extention)
+        trimmed_filepath = os.path.join(directory, file_no_extension + '_trimmed' + extention)
 
-        self.trim_filepath = filepath
-        audio.export(filepath, format="mp3"), print(f"[TrimAudio] Audio trimmed and saved at {filepath}")
-        self.state = Controller.State.TRIMMED
+        if self.sample_accurate_trim or not ffmpeg_available():
+            from pydub import AudioSegment
+            audio = AudioSegment.from_file(filepath)
+
+            if len(audio) <= time_start:
+                raise ValueError('Start time greater or equal to audio length! >:(')
+
+            audio = audio[time_start:] if time_end == 0 else audio[time_start:time_end]
+            # Decoding loses the tags and the cover, they are written again by the export. pydub
+            # only embeds covers in MP3s
+            export_format = get_export_format(filepath)
+            with tempfile.TemporaryDirectory() as temp_dir:
+                cover_path = os.path.join(temp_dir, 'cover.jpg')
+                cover = cover_path if export_format == 'mp3' and extract_cover(filepath, cover_path) else None
+                audio.export(trimmed_filepath, format=export_format, tags=read_metadata(filepath)['tags'], cover=cover)
+        else:
+            if get_audio_duration(filepath) <= time_start:
+                raise ValueError('Start time greater or equal to audio length! >:(')
+
+            trim_stream_copy(filepath, trimmed_filepath, time_start, time_end)
+
+        print(f"[TrimAudio] Audio trimmed and saved at {trimmed_filepath}")
+        return trimmed_filepath
     
-    def __progress_hook(self, d):
+    def detect_trim_timestamps(self, filepath: str) -> Dict[str, List[int | float]]:
+        try:
+            start, end = detect_audio_bounds(filepath, self.silence_threshold)
+        except (FileNotFoundError, ValueError) as e:
+            self.error_message = e
+            self.state = Controller.State.ERROR
+            raise
+        return {'start': get_timestamp(max(start - self.silence_padding, 0)),
+                'end': get_timestamp(end + self.silence_padding)}
+
+    def auto_trim_audio_file(self, filepath: str) -> None:
+        # Removes leading and trailing silence
+        self.trim_timestamps = self.detect_trim_timestamps(filepath)
+        self.trim_audio_file(filepath)
+
+    def load_waveform(self, filepath: str) -> WaveformPeaks:
+        # Peaks for the trim view, computed once per file and kept next to it
+        try:
+            return WaveformPeaks.open(filepath)
+        except (FileNotFoundError, ValueError) as e:
+            self.error_message = e
+            self.state = Controller.State.ERROR
+            raise
+
+    def split_audio_file(self, filepath: str, segments: List[Dict[str, any]], output_dir: str | None = None) -> List[str]:
+        # Segments are {'start': ms, 'end': ms, 'title': str}, see trim.parse_cue_sheet
+        try:
+            self.split_filepaths = split_file(filepath, segments, output_dir, self.sample_accurate_trim)
+        except (FileNotFoundError, ValueError) as e:
+            self.error_message = e
+            self.state = Controller.State.ERROR
+            raise
+        self.state = Controller.State.SPLIT
+        return self.split_filepaths
+
+    def batch_split_audio_files(self, files: Dict[str, List[Dict[str, any]]],
+                                output_dir: str | None = None) -> Dict[str, List[str] | Exception]:
+        # Each source file is split in its own process, see trim.batch_split
+        results = batch_split(files, output_dir, self.sample_accurate_trim, self.max_workers)
+        self.split_filepaths = [path for paths in results.values() if isinstance(paths, list) for path in paths]
+        failed = [source for source, paths in results.items() if isinstance(paths, Exception)]
+        if failed:
+            self.error_message = f"Could not split {', '.join(failed)}"
+            self.state = Controller.State.ERROR
+        else:
+            self.state = Controller.State.SPLIT
+        return results
+
+    def __stream_job(self, job: DownloadJob, ydl, info: Dict[str, any], opts: Dict[str, any]) -> bool:
+        # Downloads the selected format straight into ffmpeg, reports progress through the same hooks
+        # as yt_dlp. False when the format can't be streamed and the regular download has to run
+        from yt_dlp.downloader.common import FileDownloader
+        from yt_dlp.postprocessor.ffmpeg import ACODECS
+        audio_pp = opts['postprocessors'][0]
+        if not is_streamable(info) or audio_pp['preferredcodec'] not in ACODECS:
+            return False
+
+        filepath = os.path.splitext(ydl.prepare_filename(info))[0] + '.' + ACODECS[audio_pp['preferredcodec']][0]
+        os.makedirs(os.path.dirname(filepath) or '.', exist_ok=True)
+        duration = info.get('duration')
+        start = get_time_milliseconds(job.trim_timestamps['start'])
+        end = get_time_milliseconds(job.trim_timestamps['end'])
+        started = time.monotonic()
+
+        def progress(downloaded: int, total: int | None, encoded: int) -> None:
+            elapsed = time.monotonic() - started
+            speed = downloaded / elapsed if elapsed > 0 else None
+            eta = int((total - downloaded) / speed) if total and speed else None
+            if duration:
+                job.download_status['transcode_progress'] = FileDownloader.format_percent(
+                    min(100 * encoded / ((end or duration * 1000) - start), 100))
+            status = {'status': 'downloading', 'downloaded_bytes': downloaded, 'total_bytes': total, 'elapsed': elapsed,
+                      'speed': speed, '_eta_str': FileDownloader.format_eta(eta), '_speed_str': FileDownloader.format_speed(speed)}
+            # Without a size the percentage stays unset, like yt_dlp leaves it
+            if total:
+                status['_percent_str'] = FileDownloader.format_percent(100 * downloaded / total)
+            self.__progress_hook(job, status)
+
+        metadata_args, cover = [], None
+        if self.embed_metadata:
+            metadata_args = get_metadata_args(info)
+            if ACODECS[audio_pp['preferredcodec']][0] in COVER_EXTENSIONS:
+                cover = self.thumbnails.get(ydl, info)
+        stream_transcode(ydl, info, filepath, audio_pp['preferredcodec'], audio_pp['preferredquality'],
+                         start, end, self.ydl_opts.get('http_chunk_size') or 10485760, progress, metadata_args, cover)
+        self.__progress_hook(job, {'status': 'finished', 'info_dict': info, 'filename': filepath,
+                                   'total_bytes': os.path.getsize(filepath), 'elapsed': time.monotonic() - started})
+        self.__post_hook(job, filepath)
+        return True
+
+    def __progress_hook(self, job: DownloadJob, d):
         if d['status'] == 'downloading':
-            self.state = self.State.DOWNLOADING
-            self.download_status['progress'] = d['_percent_str']
-            self.download_status['eta'] = d['_eta_str']
-            self.download_status['speed'] = d['_speed_str']
+            job.download_status['progress'] = d.get('_percent_str', '')
+            job.download_status['eta'] = d.get('_eta_str', '')
+            job.download_status['speed'] = d.get('_speed_str', '')
+            if d.get('elapsed') and d.get('downloaded_bytes') is not None:
+                job.download_status['throughput'] = int(d['downloaded_bytes'] / d['elapsed'])
+            self.bandwidth.tick()
+            self.metrics.progress(job.id, d)
+            job.download_status['rate_limit'] = self.bandwidth.allocation(job.id) or ''
+            self.__set_job_state(job, self.State.DOWNLOADING)
         if d['status'] == 'finished':
-            self.state = self.State.POSTPROCESSING
-            self.save_filename = os.path.split(d['filename'])[1] + '.mp3' # Adding extension to filename variable (yt_dlp adds by default to saved file)
-            self.download_status['file_size'] = d['total_bytes']
-            self.download_status['elapsed_time'] = d['elapsed']
+            info = d.get('info_dict', {})
+            job.title = info.get('title', '')
+            job.chapters = info.get('chapters') or []
+            if info.get('id'):
+                job.video_id = info['id']
+                job.archive_id = job.archive_id or f"{info.get('extractor_key', '').lower()} {info['id']}"
+            # The extension is only known after FFmpegExtractAudio ran, see __post_hook
+            job.save_filename = os.path.split(d['filename'])[1]
+            job.download_status['file_size'] = d.get('total_bytes', '')
+            job.download_status['elapsed_time'] = d.get('elapsed', '')
+            self.__set_job_state(job, self.State.POSTPROCESSING)
         if d['status'] == 'error':
-            self.state = self.State.ERROR
-            self.error_message = d['error']
+            job.error_message = d['error']
+            self.__set_job_state(job, self.State.ERROR)
+
+    def __post_hook(self, job: DownloadJob, filepath: str) -> None:
+        # Called with the final file once every postprocessor ran
+        job.save_dir, job.save_filename = os.path.split(filepath)
+
+    def __set_job_state(self, job: DownloadJob, state: State) -> None:
+        was_finished = job.finished
+        job.state = state
+        # Every state is a phase of the job, the metrics are written once it is finished
+        if not job.finished:
+            job.finished_at = None
+            self.metrics.get(job.id).enter(state.name.lower())
+        elif not was_finished:
+            job.finished_at = time.time()
+            self.metrics.finish(job, {'codec': job.codec or self.ydl_opts['postprocessors'][0]['preferredcodec']})
+        # The controller mirrors the job that changed last, which is what the view displays
+        self.current_job = job
+        self.download_status = job.download_status
+        self.trim_filepath = job.trim_filepath
+        self.trimmed_download = job.trimmed_download
+        self.error_message = job.error_message
+        self.__state = state
+
+        # Progress updates are not persisted, only the transitions a restart has to know about
+        if self.persist_jobs:
+            if state in (Controller.State.DONE, Controller.State.SKIPPED):
+                self.job_store.remove(job)
+            elif state in (Controller.State.REQUEST, Controller.State.POSTPROCESSING, Controller.State.ERROR):
+                self.job_store.save(job)
+
+        self.__notify(job)
         
     def save_config(self) -> None:
         config = {
             'default_save_dir': self.default_save_dir,
+            'max_workers': self.max_workers,
+            'use_archive': self.use_archive,
+            'sample_accurate_trim': self.sample_accurate_trim,
+            'download_sections': self.download_sections,
+            'default_filename': self.default_filename,
+            'max_attempts': self.max_attempts,
+            'silence_threshold': self.silence_threshold,
+            'silence_padding': self.silence_padding,
+            'normalize_loudness': self.normalize_loudness,
+            'loudness_target': self.loudness_target,
+            'quality_profiles': self.quality_profiles,
+            'quality_profile': self.quality_profile,
+            'rate_limit': self.bandwidth.rate_limit,
+            'rate_limit_profiles': self.bandwidth.profiles,
+            'use_store': self.use_store,
+            'store_dir': self.store_dir,
+            'streaming': self.streaming,
+            'library_scan_interval': self.library_scan_interval,
+            'embed_metadata': self.embed_metadata,
+            'thumbnail_cache_size': self.thumbnail_cache_size,
         }
         os.makedirs(self.__config_dir, exist_ok=True)
         with open(self.__config_path, 'w') as f:
@@ -158,6 +905,26 @@ class Controller:
             with open(self.__config_path, 'r') as f:
                 config = json.load(f)
                 self.default_save_dir = config['default_save_dir']
+                self.max_workers = config.get('max_workers', self.max_workers)
+                self.use_archive = config.get('use_archive', self.use_archive)
+                self.sample_accurate_trim = config.get('sample_accurate_trim', self.sample_accurate_trim)
+                self.download_sections = config.get('download_sections', self.download_sections)
+                self.default_filename = config.get('default_filename', self.default_filename)
+                self.max_attempts = config.get('max_attempts', self.max_attempts)
+                self.silence_threshold = config.get('silence_threshold', self.silence_threshold)
+                self.silence_padding = config.get('silence_padding', self.silence_padding)
+                self.normalize_loudness = config.get('normalize_loudness', self.normalize_loudness)
+                self.loudness_target = config.get('loudness_target', self.loudness_target)
+                self.quality_profiles = config.get('quality_profiles', self.quality_profiles)
+                self.quality_profile = config.get('quality_profile', self.quality_profile)
+                self.bandwidth.rate_limit = config.get('rate_limit', self.bandwidth.rate_limit)
+                self.bandwidth.profiles = config.get('rate_limit_profiles', self.bandwidth.profiles)
+                self.use_store = config.get('use_store', self.use_store)
+                self.store_dir = config.get('store_dir', self.store_dir)
+                self.streaming = config.get('streaming', self.streaming)
+                self.library_scan_interval = config.get('library_scan_interval', self.library_scan_interval)
+                self.embed_metadata = config.get('embed_metadata', self.embed_metadata)
+                self.thumbnail_cache_size = config.get('thumbnail_cache_size', self.thumbnail_cache_size)
         except FileNotFoundError:
             self.save_config()
             self.load_config()
@@ -0,0 +1,116 @@
+import os
+import json
+import hashlib
+import itertools
+from concurrent.futures import Future
+from typing import Dict, List
+from controller.state import State
+from utils.utils import remove_ansi_escape_sequences
+
+class DownloadJob:
+    __ids = itertools.count(1)
+    # Interactive downloads get a larger share of the bandwidth, see BandwidthScheduler
+    PRIORITY_BACKGROUND = 0
+    PRIORITY_INTERACTIVE = 1
+
+    def __init__(self, url: str, save_dir: str, custom_filename: str = '',
+                 trim_timestamps: Dict[str, List[int | float]] | None = None) -> None:
+        self.id: int = next(DownloadJob.__ids)
+        self.url: str = url
+        self.save_dir: str = save_dir
+        self.custom_filename: str = custom_filename
+        self.codec: str = ''
+        self.split_chapters: bool = False
+        self.priority: int = DownloadJob.PRIORITY_BACKGROUND
+        # Runs the job under cProfile
+        self.profile: bool = False
+        self.video_id: str = ''
+        self.title: str = ''
+        self.chapters: List[Dict[str, any]] = []
+        self.split_filepaths: List[str] = []
+        self.archive_id: str = ''
+        self.playlist_index: int | None = None
+        self.save_filename: str = ''
+        self.trim_filepath: str = ''
+        self.trim_timestamps: Dict[str, List[int | float]] = trim_timestamps if trim_timestamps is not None else {'start': [0, 0, 0], 'end': [0, 0, 0]}
+        self.trimmed_download: bool = False
+        self.download_status: Dict[str, any] = {'progress': '', 'eta': '', 'speed': '',
+                                                 'file_size': '', 'elapsed_time': '',
+                                                 'throughput': '', 'rate_limit': '', 'transcode_progress': ''}
+        self.state: State = State.IDLE
+        # Unix time the job reached DONE, ERROR or SKIPPED
+        self.finished_at: float | None = None
+        self.error_message: str = ''
+        self.attempts: int = 0
+        self.future: Future | None = None
+        self.__key: str = ''
+
+    @property
+    def key(self) -> str:
+        # Same job, same key, so a restarted job finds the state of the previous run. Computed once,
+        # since the save directory is updated with the final path once the download is done
+        if self.__key == '':
+            identity = json.dumps([self.url, self.save_dir, self.custom_filename, self.trim_timestamps, self.codec])
+            self.__key = hashlib.sha1(identity.encode()).hexdigest()[:16]
+        return self.__key
+
+    @property
+    def save_path(self) -> str:
+        return os.path.join(self.save_dir, self.save_filename)
+
+    @property
+    def finished(self) -> bool:
+        return self.state in (State.DONE, State.ERROR, State.SKIPPED)
+
+    def to_dict(self) -> Dict[str, any]:
+        return {
+            'id': self.id,
+            'url': self.url,
+            'state': self.state.name,
+            'progress': remove_ansi_escape_sequences(self.download_status['progress']).strip(),
+            'speed': remove_ansi_escape_sequences(self.download_status['speed']).strip(),
+            'eta': remove_ansi_escape_sequences(self.download_status['eta']).strip(),
+            # Bytes per second, averaged over the download and the share of the bandwidth budget
+            'throughput': self.download_status.get('throughput', ''),
+            'rate_limit': self.download_status.get('rate_limit', ''),
+            # Share of the audio ffmpeg already encoded, streamed jobs only
+            'transcode_progress': remove_ansi_escape_sequences(self.download_status.get('transcode_progress', '')).strip(),
+            # The filename is still a yt_dlp template until the download starts
+            'path': self.save_path if self.save_filename and '%(' not in self.save_filename else '',
+            'trim_path': self.trim_filepath,
+            'split_paths': self.split_filepaths,
+            'error': str(self.error_message),
+        }
+
+    def to_state(self) -> Dict[str, any]:
+        return {
+            'url': self.url,
+            'save_dir': self.save_dir,
+            'custom_filename': self.custom_filename,
+            'trim_timestamps': self.trim_timestamps,
+            'codec': self.codec,
+            'split_chapters': self.split_chapters,
+            'priority': self.priority,
+            'video_id': self.video_id,
+            'archive_id': self.archive_id,
+            'playlist_index': self.playlist_index,
+            'save_filename': self.save_filename,
+            'state': self.state.name,
+            'attempts': self.attempts,
+        }
+
+    @classmethod
+    def from_state(cls, state: Dict[str, any]) -> 'DownloadJob':
+        job = cls(state['url'], state['save_dir'], state['custom_filename'], state['trim_timestamps'])
+        job.codec = state.get('codec', '')
+        job.split_chapters = state.get('split_chapters', False)
+        job.priority = state.get('priority', DownloadJob.PRIORITY_BACKGROUND)
+        job.video_id = state.get('video_id', '')
+        job.archive_id = state.get('archive_id', '')
+        job.playlist_index = state.get('playlist_index')
+        job.save_filename = state.get('save_filename', '')
+        job.attempts = state.get('attempts', 0)
+        return job
+
+    def __repr__(self) -> str:
+        return f'DownloadJob(id={self.id}, url={self.url!r}, state={self.state.name})'
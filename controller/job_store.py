@@ -0,0 +1,42 @@
+import os
+import json
+import threading
+from typing import Dict, List
+from controller.job import DownloadJob
+from utils.utils import atomic_write
+
+class JobStore:
+    def __init__(self, directory: str) -> None:
+        self.directory: str = directory
+        self.__lock = threading.Lock()
+
+    def path(self, job: DownloadJob) -> str:
+        return os.path.join(self.directory, f'{job.key}.json')
+
+    def save(self, job: DownloadJob) -> None:
+        with self.__lock:
+            os.makedirs(self.directory, exist_ok=True)
+            with atomic_write(self.path(job)) as f:
+                json.dump(job.to_state(), f)
+
+    def remove(self, job: DownloadJob) -> None:
+        with self.__lock:
+            try:
+                os.remove(self.path(job))
+            except FileNotFoundError:
+                pass
+
+    def load_all(self) -> List[Dict[str, any]]:
+        states = []
+        with self.__lock:
+            if not os.path.isdir(self.directory):
+                return states
+            for file in sorted(os.listdir(self.directory)):
+                if not file.endswith('.json'):
+                    continue
+                try:
+                    with open(os.path.join(self.directory, file), 'r') as f:
+                        states.append(json.load(f))
+                except (OSError, ValueError):
+                    continue
+        return states
@@ -0,0 +1,313 @@
+import os
+import re
+import sys
+import json
+import time
+import select
+import ctypes
+import struct
+import sqlite3
+import threading
+import subprocess
+from typing import Dict, Iterable, List
+
+AUDIO_EXTENSIONS = ('.mp3', '.m4a', '.opus', '.ogg', '.flac', '.wav', '.aac')
+# Temporary files of yt_dlp, ffmpeg and the streaming transcode
+TEMPORARY_MARKERS = ('.part', '.temp.', '.tmp')
+# The default filename template ends with "[<video id>]"
+VIDEO_ID = re.compile(r'\[([\w-]+)\]$')
+DURATION = re.compile(r'Duration: (\d+):(\d+):(\d+(?:\.\d+)?)')
+
+def is_audio_file(filepath: str) -> bool:
+    name = os.path.basename(filepath)
+    return name.lower().endswith(AUDIO_EXTENSIONS) and not name.startswith('.') and not any(marker in name for marker in TEMPORARY_MARKERS)
+
+def read_metadata(filepath: str) -> Dict[str, any]:
+    # One ffmpeg call that only reads the headers, the duration (milliseconds) comes from the
+    # input description and the tags from the ffmetadata output
+    process = subprocess.run(['ffmpeg', '-hide_banner', '-i', filepath, '-f', 'ffmetadata', '-'], capture_output=True)
+    match = DURATION.search(process.stderr.decode(errors='replace'))
+    duration = None
+    if match is not None:
+        hours, minutes, seconds = match.groups()
+        duration = int((int(hours) * 3600 + int(minutes) * 60 + float(seconds)) * 1000)
+
+    tags = {}
+    for line in re.split(r'(?<!\\)\n', process.stdout.decode(errors='replace')):
+        # Global tags only, they come before the first [STREAM] or [CHAPTER] section
+        if line.startswith('['):
+            break
+        if line.startswith((';', '#')) or '=' not in line:
+            continue
+        key, value = re.split(r'(?<!\\)=', line, 1)
+        tags[key.lower()] = re.sub(r'\\(.)', r'\1', value, flags=re.DOTALL)
+    tags.pop('encoder', None)
+    return {'duration': duration, 'tags': tags}
+
+class LibraryIndex:
+    # Every audio file in the save directories with its size, mtime, duration, source video and tags.
+    # Files are only probed when they are new or changed, so keeping the index current costs a stat per file
+    def __init__(self, path: str) -> None:
+        self.path: str = path
+        self.__lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        # A single connection is shared by the watcher and the download workers, access goes through the lock
+        self.__connection = sqlite3.connect(self.path, check_same_thread=False)
+        with self.__lock, self.__connection:
+            self.__connection.execute('''
+                CREATE TABLE IF NOT EXISTS files (
+                    path TEXT PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    mtime REAL NOT NULL,
+                    added REAL NOT NULL,
+                    duration INTEGER,
+                    video_id TEXT,
+                    title TEXT NOT NULL,
+                    tags TEXT NOT NULL
+                )''')
+            self.__connection.execute('CREATE INDEX IF NOT EXISTS files_added ON files (added)')
+            self.__connection.execute('CREATE INDEX IF NOT EXISTS files_video_id ON files (video_id)')
+
+    @staticmethod
+    def __range(root: str) -> List[str]:
+        # Every path below root sorts between these two, so the primary key index answers prefix queries
+        root = os.path.join(os.path.abspath(root), '')
+        return [root, root[:-1] + chr(ord(os.sep) + 1)]
+
+    @classmethod
+    def __within(cls, roots: List[str] | None) -> tuple:
+        # WHERE clause and arguments of the paths below any of roots, everything without roots
+        if not roots:
+            return '1', []
+        return ' OR '.join(['(path > ? AND path < ?)'] * len(roots)), [arg for root in roots for arg in cls.__range(root)]
+
+    @staticmethod
+    def __to_dict(row: Iterable[any]) -> Dict[str, any]:
+        path, size, mtime, added, duration, video_id, title, tags = row
+        return {'path': path, 'size': size, 'mtime': mtime, 'added': added, 'duration': duration,
+                'video_id': video_id, 'title': title, 'tags': json.loads(tags)}
+
+    def add(self, filepath: str, video_id: str | None = None, title: str | None = None, added: float | None = None) -> None:
+        # What the downloader knows about the file (video id, title) is kept when the watcher sees it again
+        filepath = os.path.abspath(filepath)
+        stat = os.stat(filepath)
+        metadata = read_metadata(filepath)
+        stem = os.path.splitext(os.path.basename(filepath))[0]
+        match = VIDEO_ID.search(stem)
+        default_title = metadata['tags'].get('title') or VIDEO_ID.sub('', stem).strip() or stem
+        with self.__lock, self.__connection:
+            self.__connection.execute('''
+                INSERT INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (path) DO UPDATE SET
+                    size = excluded.size, mtime = excluded.mtime, duration = excluded.duration, tags = excluded.tags,
+                    video_id = COALESCE(?, files.video_id, excluded.video_id), title = COALESCE(?, files.title)''',
+                (filepath, stat.st_size, stat.st_mtime, added if added is not None else time.time(), metadata['duration'],
+                 video_id or (match.group(1) if match else None), title or default_title, json.dumps(metadata['tags']),
+                 video_id, title))
+
+    def remove(self, path: str) -> None:
+        # A file, or a directory with everything below it
+        path = os.path.abspath(path)
+        with self.__lock, self.__connection:
+            self.__connection.execute('DELETE FROM files WHERE path = ? OR (path > ? AND path < ?)', (path, *self.__range(path)))
+
+    def scan(self, root: str) -> Dict[str, int]:
+        # Stat diff of root against the index, for the changes no watcher saw (before the start,
+        # on network file systems, after an inotify queue overflow)
+        with self.__lock:
+            known = {path: (size, mtime) for path, size, mtime in self.__connection.execute(
+                'SELECT path, size, mtime FROM files WHERE path > ? AND path < ?', self.__range(root))}
+        counts = {'added': 0, 'updated': 0, 'removed': 0}
+        directories = [os.path.abspath(root)]
+        while directories:
+            directory = directories.pop()
+            try:
+                entries = list(os.scandir(directory))
+            except (FileNotFoundError, NotADirectoryError, PermissionError):
+                continue
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        directories.append(entry.path)
+                        continue
+                    if not is_audio_file(entry.path):
+                        continue
+                    stat = entry.stat()
+                    previous = known.pop(entry.path, None)
+                    if previous == (stat.st_size, stat.st_mtime):
+                        continue
+                    # Files found by a scan were added when they were created, not when the scan ran
+                    self.add(entry.path, added=stat.st_ctime)
+                    counts['added' if previous is None else 'updated'] += 1
+                except (FileNotFoundError, PermissionError):
+                    continue
+        for path in known:
+            self.remove(path)
+        counts['removed'] = len(known)
+        return counts
+
+    def latest(self, roots: List[str] | None = None) -> str | None:
+        where, args = self.__within(roots)
+        with self.__lock:
+            paths = [path for path, in self.__connection.execute(
+                f'SELECT path FROM files WHERE {where} ORDER BY added DESC LIMIT 16', args)]
+        # Files deleted since the last scan are dropped on the way
+        for path in paths:
+            if os.path.exists(path):
+                return path
+            self.remove(path)
+        return None
+
+    def find_video(self, video_id: str) -> List[Dict[str, any]]:
+        with self.__lock:
+            rows = self.__connection.execute('SELECT * FROM files WHERE video_id = ? ORDER BY added DESC', (video_id,)).fetchall()
+        return [self.__to_dict(row) for row in rows]
+
+    def search(self, text: str = '', roots: List[str] | None = None, limit: int = 100) -> List[Dict[str, any]]:
+        # Newest first, text matches the title or the path case insensitively
+        pattern = '%' + re.sub(r'([\\%_])', r'\\\1', text) + '%'
+        where, args = self.__within(roots)
+        with self.__lock:
+            rows = self.__connection.execute(
+                f"SELECT * FROM files WHERE (title LIKE ? ESCAPE '\\' OR path LIKE ? ESCAPE '\\') AND ({where}) "
+                'ORDER BY added DESC LIMIT ?', (pattern, pattern, *args, limit)).fetchall()
+        return [self.__to_dict(row) for row in rows]
+
+    def close(self) -> None:
+        with self.__lock:
+            self.__connection.close()
+
+class Inotify:
+    # The few inotify calls the watcher needs, through libc so there is no extra dependency
+    IN_CLOSE_WRITE = 0x8
+    IN_MOVED_FROM = 0x40
+    IN_MOVED_TO = 0x80
+    IN_CREATE = 0x100
+    IN_DELETE = 0x200
+    IN_Q_OVERFLOW = 0x4000
+    IN_IGNORED = 0x8000
+    IN_ISDIR = 0x40000000
+    MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+    EVENT = struct.Struct('iIII')
+
+    def __init__(self) -> None:
+        if not sys.platform.startswith('linux'):
+            raise OSError('inotify is only available on Linux')
+        self.__libc = ctypes.CDLL(None, use_errno=True)
+        self.fd: int = self.__libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.watches: Dict[int, str] = {}
+
+    def add_watch(self, directory: str) -> None:
+        wd = self.__libc.inotify_add_watch(self.fd, os.fsencode(directory), self.MASK)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f'Could not watch {directory}')
+        self.watches[wd] = directory
+
+    def add_watches(self, root: str) -> None:
+        for directory, _, _ in os.walk(root):
+            try:
+                self.add_watch(directory)
+            except OSError:
+                # Out of watches (fs.inotify.max_user_watches), the periodic scan still covers the rest
+                pass
+
+    def read(self, timeout: float) -> List[tuple]:
+        # (path, mask) of every event within timeout seconds
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return []
+        try:
+            data = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return []
+        events, offset = [], 0
+        while offset < len(data):
+            wd, mask, _, length = self.EVENT.unpack_from(data, offset)
+            name = data[offset + self.EVENT.size:offset + self.EVENT.size + length].rstrip(b'\0')
+            offset += self.EVENT.size + length
+            if mask & self.IN_IGNORED:
+                self.watches.pop(wd, None)
+            elif wd in self.watches or mask & self.IN_Q_OVERFLOW:
+                directory = self.watches.get(wd, '')
+                events.append((os.path.join(directory, os.fsdecode(name)) if name else directory, mask))
+        return events
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+class LibraryWatcher:
+    # Keeps the index of the roots current: one stat diff at the start, inotify events while running and
+    # another stat diff every interval seconds, which is all there is where inotify isn't available
+    POLL_TIMEOUT = 1.0
+
+    def __init__(self, index: LibraryIndex, roots: List[str], interval: float = 300) -> None:
+        self.index: LibraryIndex = index
+        self.roots: List[str] = [os.path.abspath(root) for root in roots]
+        self.interval: float = interval
+        self.__stop = threading.Event()
+        self.__thread: threading.Thread | None = None
+
+    def start(self) -> 'LibraryWatcher':
+        self.__thread = threading.Thread(target=self.__run, name='LibraryWatcher', daemon=True)
+        self.__thread.start()
+        return self
+
+    def stop(self, wait: bool = True) -> None:
+        # A scan that is running is finished first
+        self.__stop.set()
+        if wait and self.__thread is not None and self.__thread is not threading.current_thread():
+            self.__thread.join()
+
+    def scan(self) -> None:
+        for root in self.roots:
+            if os.path.isdir(root):
+                self.index.scan(root)
+
+    def __run(self) -> None:
+        try:
+            inotify = Inotify()
+        except (OSError, AttributeError):
+            inotify = None
+        try:
+            if inotify is not None:
+                # Watches go first, so nothing that changes during the first scan is missed
+                for root in self.roots:
+                    if os.path.isdir(root):
+                        inotify.add_watches(root)
+            self.scan()
+            last_scan = time.monotonic()
+            while not self.__stop.is_set():
+                # A fixed poll, so stop() is noticed within a second. An interval of 0 turns the rescans off
+                if inotify is None:
+                    self.__stop.wait(LibraryWatcher.POLL_TIMEOUT)
+                else:
+                    for path, mask in inotify.read(LibraryWatcher.POLL_TIMEOUT):
+                        self.__handle(inotify, path, mask)
+                if self.interval > 0 and time.monotonic() - last_scan >= self.interval:
+                    self.scan()
+                    last_scan = time.monotonic()
+        finally:
+            if inotify is not None:
+                inotify.close()
+
+    def __handle(self, inotify: Inotify, path: str, mask: int) -> None:
+        try:
+            if mask & Inotify.IN_Q_OVERFLOW:
+                self.scan()
+            elif mask & Inotify.IN_ISDIR:
+                if mask & (Inotify.IN_CREATE | Inotify.IN_MOVED_TO):
+                    inotify.add_watches(path)
+                    self.index.scan(path)
+                elif mask & (Inotify.IN_DELETE | Inotify.IN_MOVED_FROM):
+                    self.index.remove(path)
+            elif not is_audio_file(path):
+                return
+            elif mask & (Inotify.IN_CLOSE_WRITE | Inotify.IN_MOVED_TO):
+                self.index.add(path)
+            elif mask & (Inotify.IN_DELETE | Inotify.IN_MOVED_FROM):
+                self.index.remove(path)
+        except (FileNotFoundError, PermissionError):
+            # Gone again before it could be read, the delete event follows
+            pass
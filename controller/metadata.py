@@ -0,0 +1,32 @@
+import copy
+import time
+import threading
+from collections import OrderedDict
+from typing import Dict, Tuple
+
+class MetadataCache:
+    # Extracted info dicts by video id. Entries expire since the format URLs in them do too
+    def __init__(self, max_entries: int = 64, ttl: float = 1800.0) -> None:
+        self.max_entries: int = max_entries
+        self.ttl: float = ttl
+        self.__entries: OrderedDict[str, Tuple[float, Dict[str, any]]] = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def get(self, key: str) -> Dict[str, any] | None:
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is None:
+                return None
+            if time.monotonic() - entry[0] > self.ttl:
+                del self.__entries[key]
+                return None
+            self.__entries.move_to_end(key)
+        # yt_dlp fills in the info dict while processing it, every caller gets its own copy
+        return copy.deepcopy(entry[1])
+
+    def put(self, key: str, info: Dict[str, any]) -> None:
+        with self.__lock:
+            self.__entries[key] = (time.monotonic(), info)
+            self.__entries.move_to_end(key)
+            while len(self.__entries) > self.max_entries:
+                self.__entries.popitem(last=False)
@@ -0,0 +1,133 @@
+import os
+import json
+import time
+import threading
+import contextlib
+from typing import Dict, Iterator, List, Tuple
+from utils.utils import atomic_write
+
+try:
+    import resource
+except ImportError:
+    # Windows, CPU time of ffmpeg and the other child processes is not available there
+    resource = None
+
+def child_cpu_time() -> float:
+    # CPU time of finished child processes (ffmpeg, pydub's ffmpeg). Process wide, so with several
+    # workers a phase is also charged for the children of the other jobs that ended meanwhile
+    if resource is None:
+        return 0.0
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+class JobMetrics:
+    def __init__(self, job_id: int) -> None:
+        self.job_id: int = job_id
+        self.started: float = time.time()
+        self.phases: Dict[str, Dict[str, float]] = {}
+        self.phase: str | None = None
+        self.bytes: int = 0
+        self.peak_throughput: float = 0.0
+        self.download_seconds: float = 0.0
+        self.__mark: Tuple[int, float, float, float] = self.mark()
+
+    @staticmethod
+    def mark() -> Tuple[int, float, float, float]:
+        return threading.get_ident(), time.perf_counter(), time.thread_time(), child_cpu_time()
+
+    def enter(self, phase: str | None) -> None:
+        # Closes the running phase. CPU time is per thread, it is only counted while the phase
+        # starts and ends on the same thread (fragment downloads report progress from their own)
+        if phase == self.phase:
+            return
+        mark = self.mark()
+        if self.phase is not None:
+            totals = self.phases.setdefault(self.phase, {'seconds': 0.0, 'cpu_seconds': 0.0, 'child_cpu_seconds': 0.0})
+            totals['seconds'] += mark[1] - self.__mark[1]
+            if mark[0] == self.__mark[0]:
+                totals['cpu_seconds'] += mark[2] - self.__mark[2]
+            totals['child_cpu_seconds'] += mark[3] - self.__mark[3]
+        self.phase, self.__mark = phase, mark
+
+    def to_dict(self) -> Dict[str, any]:
+        return {
+            'bytes': self.bytes,
+            'average_throughput': int(self.bytes / self.download_seconds) if self.download_seconds else 0,
+            'peak_throughput': int(self.peak_throughput),
+            'total_seconds': round(sum(phase['seconds'] for phase in self.phases.values()), 3),
+            'phases': {name: {key: round(value, 3) for key, value in totals.items()} for name, totals in self.phases.items()},
+        }
+
+class MetricsRecorder:
+    PREFIX = 'mp3_yt_downloader'
+
+    def __init__(self, jsonl_path: str, prometheus_path: str) -> None:
+        # One JSON line per finished job, plus the totals in Prometheus' text format for a textfile collector
+        self.jsonl_path: str = jsonl_path
+        self.prometheus_path: str = prometheus_path
+        self.__jobs: Dict[int, JobMetrics] = {}
+        self.__totals: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float] = {}
+        self.__lock = threading.Lock()
+
+    def get(self, job_id: int) -> JobMetrics:
+        with self.__lock:
+            return self.__jobs.setdefault(job_id, JobMetrics(job_id))
+
+    @contextlib.contextmanager
+    def phase(self, job_id: int, name: str) -> Iterator[None]:
+        # Phases that don't have a state of their own, like trimming after the download
+        metrics = self.get(job_id)
+        previous = metrics.phase
+        metrics.enter(name)
+        try:
+            yield
+        finally:
+            metrics.enter(previous)
+
+    def progress(self, job_id: int, d: Dict[str, any]) -> None:
+        metrics = self.get(job_id)
+        metrics.bytes = d.get('downloaded_bytes') or metrics.bytes
+        metrics.download_seconds = d.get('elapsed') or metrics.download_seconds
+        metrics.peak_throughput = max(metrics.peak_throughput, d.get('speed') or 0)
+
+    def finish(self, job, extra: Dict[str, any] | None = None) -> Dict[str, any]:
+        with self.__lock:
+            metrics = self.__jobs.pop(job.id, None) or JobMetrics(job.id)
+        metrics.enter(None)
+        record = {'event': 'job_metrics', 'id': job.id, 'url': job.url, 'state': job.state.name,
+                  'attempts': job.attempts, 'started': metrics.started, **metrics.to_dict(), **(extra or {})}
+
+        with self.__lock:
+            self.__add('jobs_total', 1, state=job.state.name.lower())
+            self.__add('downloaded_bytes_total', metrics.bytes)
+            self.__add('job_seconds_sum', record['total_seconds'])
+            self.__add('job_seconds_count', 1)
+            for name, totals in metrics.phases.items():
+                self.__add('phase_seconds_total', totals['seconds'], phase=name)
+                self.__add('phase_cpu_seconds_total', totals['cpu_seconds'], phase=name)
+                self.__add('phase_child_cpu_seconds_total', totals['child_cpu_seconds'], phase=name)
+            self.write(record, self.__render())
+        return record
+
+    def __add(self, name: str, value: float, **labels: str) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        self.__totals[key] = self.__totals.get(key, 0) + value
+
+    def prometheus_text(self, gauges: Dict[str, float] | None = None) -> str:
+        with self.__lock:
+            return self.__render(gauges)
+
+    def __render(self, gauges: Dict[str, float] | None = None) -> str:
+        lines: List[str] = []
+        for (name, labels), value in sorted(list(self.__totals.items()) + [((name, ()), value) for name, value in (gauges or {}).items()]):
+            label_text = ','.join(f'{key}="{value}"' for key, value in labels)
+            lines.append(f'{self.PREFIX}_{name}{{{label_text}}} {value:g}' if label_text else f'{self.PREFIX}_{name} {value:g}')
+        return '\n'.join(lines) + '\n'
+
+    def write(self, record: Dict[str, any], text: str) -> None:
+        os.makedirs(os.path.dirname(self.jsonl_path), exist_ok=True)
+        with open(self.jsonl_path, 'a') as f:
+            f.write(json.dumps(record, default=str) + '\n')
+        # Replaced in one step, a scraper never reads a half written file
+        with atomic_write(self.prometheus_path) as f:
+            f.write(text)
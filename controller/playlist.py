@@ -0,0 +1,34 @@
+import os
+import json
+import threading
+from typing import Dict
+from utils.utils import atomic_write
+
+class PlaylistProgress:
+    def __init__(self, path: str) -> None:
+        self.path: str = path
+        self.completed: Dict[str, str] = {}
+        self.__lock = threading.Lock()
+
+        self.load()
+
+    def load(self) -> None:
+        try:
+            with open(self.path, 'r') as f:
+                self.completed = json.load(f)
+        except FileNotFoundError:
+            self.completed = {}
+
+    def save(self) -> None:
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with atomic_write(self.path) as f:
+            json.dump(self.completed, f)
+
+    def is_completed(self, entry_id: str) -> bool:
+        filepath = self.completed.get(entry_id)
+        return filepath is not None and os.path.exists(filepath)
+
+    def mark_completed(self, entry_id: str, filepath: str) -> None:
+        with self.__lock:
+            self.completed[entry_id] = filepath
+            self.save()
@@ -0,0 +1,117 @@
+import os
+import re
+import json
+import subprocess
+from typing import Dict
+from yt_dlp.postprocessor import FFmpegExtractAudioPP, FFmpegPostProcessor
+from yt_dlp.postprocessor.common import PostProcessor
+from yt_dlp.postprocessor.ffmpeg import FFmpegPostProcessorError
+from yt_dlp.utils import PostProcessingError, prepend_extension
+from controller.tags import COVER_EXTENSIONS, get_cover_args, get_metadata_args
+
+# Only imported once a download starts, like yt_dlp itself
+
+class LoudnessMeasurePP(FFmpegPostProcessor):
+    # Output arguments of the FFmpegExtractAudio postprocessor, see yt_dlp's postprocessor_args
+    EXTRACT_AUDIO_ARGS = 'extractaudio+ffmpeg_o'
+
+    def __init__(self, downloader, archive, target: Dict[str, float], preferredcodec: str) -> None:
+        super().__init__(downloader)
+        self.archive = archive
+        self.target: Dict[str, float] = target
+        self.preferredcodec: str = preferredcodec
+
+    @PostProcessor._restrict_to(images=False)
+    def run(self, information):
+        # First pass of the EBU R128 normalization. The second pass is the loudnorm filter
+        # handed to FFmpegExtractAudio, so it happens in the transcode that runs anyway
+        postprocessor_args = dict(self.get_param('postprocessor_args') or {})
+        postprocessor_args.pop(self.EXTRACT_AUDIO_ARGS, None)
+
+        filecodec = self.get_audio_codec(information['filepath'])
+        if filecodec == self.preferredcodec or (filecodec == 'aac' and self.preferredcodec == 'm4a'):
+            # FFmpegExtractAudio only copies the stream here and filters can't be applied to a copy
+            self.to_screen('Not normalizing loudness; the audio is not transcoded')
+        else:
+            # Measurements are cached per video and section, a section sounds different than the whole video
+            section = ''
+            if information.get('section_start') is not None or information.get('section_end'):
+                section = f"{information.get('section_start') or 0}-{information.get('section_end') or ''}"
+            cache_key = f"{information.get('extractor_key', '').lower()} {information['id']} {section}"
+            measurement = self.archive.get_loudness(cache_key)
+            if measurement is None:
+                self.to_screen(f"Measuring loudness of {information['filepath']}")
+                measurement = self.measure(information['filepath'])
+                self.archive.set_loudness(cache_key, measurement)
+            postprocessor_args[self.EXTRACT_AUDIO_ARGS] = ['-af', self.loudnorm_filter(measurement)]
+
+        self._downloader.params['postprocessor_args'] = postprocessor_args
+        return [], information
+
+    def loudnorm_filter(self, measurement: Dict[str, str] | None = None) -> str:
+        loudnorm = f"loudnorm=I={self.target['I']}:TP={self.target['TP']}:LRA={self.target['LRA']}"
+        if measurement is None:
+            return loudnorm + ':print_format=json'
+        return (f"{loudnorm}:measured_I={measurement['input_i']}:measured_TP={measurement['input_tp']}"
+                f":measured_LRA={measurement['input_lra']}:measured_thresh={measurement['input_thresh']}"
+                f":offset={measurement['target_offset']}:linear=true,aresample=48000")
+
+    def measure(self, filepath: str) -> Dict[str, str]:
+        process = subprocess.run([self.executable, '-hide_banner', '-nostats', '-i', filepath,
+                                  '-af', self.loudnorm_filter(), '-f', 'null', '-'],
+                                 capture_output=True, text=True)
+        match = re.search(r'\{[^{}]*"input_i"[^{}]*\}', process.stderr)
+        if process.returncode != 0 or match is None:
+            raise ValueError(f'Could not measure the loudness of {filepath}! >:(')
+        return json.loads(match.group(0))
+
+class TaggingExtractAudioPP(FFmpegExtractAudioPP):
+    # FFmpegExtractAudio that writes the tags and the cover art in the same ffmpeg run as the transcode,
+    # instead of FFmpegMetadata and EmbedThumbnail rewriting the file afterwards
+    def __init__(self, downloader=None, thumbnails=None, **kwargs) -> None:
+        super().__init__(downloader, **kwargs)
+        self.thumbnails = thumbnails
+        self.__information = None
+        self.__converted: bool = False
+
+    @classmethod
+    def pp_key(cls) -> str:
+        # Same output name and postprocessor_args as the postprocessor it replaces
+        return FFmpegExtractAudioPP.pp_key()
+
+    def run(self, information):
+        self.__information = information
+        self.__converted = False
+        try:
+            files_to_delete, information = super().run(information)
+            # Files already in the target format (aac to m4a, mp3 to mp3, ...) are not converted, they are
+            # only remuxed to get the tags and the cover
+            if not self.__converted and information['ext'] in self.COMMON_AUDIO_EXTS:
+                path = information['filepath']
+                temp_path = prepend_extension(path, 'temp')
+                self.to_screen(f'Adding metadata to {path}')
+                self.__run_ffmpeg(path, temp_path, 'copy', [])
+                os.replace(temp_path, path)
+            return files_to_delete, information
+        finally:
+            self.__information = None
+
+    def run_ffmpeg(self, path, out_path, codec, more_opts):
+        if self.__information is None:
+            return super().run_ffmpeg(path, out_path, codec, more_opts)
+        self.__converted = True
+        self.__run_ffmpeg(path, out_path, codec, more_opts)
+
+    def __run_ffmpeg(self, path, out_path, codec, more_opts):
+        inputs = [path]
+        opts = ['-map', '0:a:0', *(['-acodec', codec] if codec is not None else []), *more_opts,
+                *get_metadata_args(self.__information)]
+        if self.thumbnails is not None and os.path.splitext(out_path)[1][1:] in COVER_EXTENSIONS:
+            cover = self.thumbnails.get(self._downloader, self.__information)
+            if cover is not None:
+                inputs.append(cover)
+                opts += get_cover_args(1)
+        try:
+            FFmpegPostProcessor.run_ffmpeg_multiple_files(self, inputs, out_path, opts)
+        except FFmpegPostProcessorError as err:
+            raise PostProcessingError(f'audio conversion failed: {err.msg}')
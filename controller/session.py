@@ -0,0 +1,81 @@
+import json
+import threading
+import contextlib
+from typing import Callable, Dict, Iterator, List
+
+class DownloadSession:
+    # A YoutubeDL that outlives its job. The next job reuses its extractors with their player and
+    # signature caches, the cookie jar and the open HTTP connections
+    def __init__(self, ydl) -> None:
+        self.ydl = ydl
+        self.progress_hooks: List[Callable[[Dict[str, any]], None]] = []
+        self.post_hooks: List[Callable[[str], None]] = []
+        # Hooks can't be removed from a YoutubeDL, these forward to the job that holds the session
+        ydl.add_progress_hook(lambda d: [hook(d) for hook in self.progress_hooks])
+        ydl.add_post_hook(lambda filepath: [hook(filepath) for hook in self.post_hooks])
+
+class SessionPool:
+    # Options that are swapped per job, sessions are only shared between jobs that agree on the rest
+    JOB_OPTIONS = ('outtmpl', 'final_ext', 'download_ranges', 'progress_hooks', 'post_hooks')
+
+    def __init__(self, factory: Callable[[Dict[str, any]], any], max_idle: int = 4,
+                 settings: Callable[[], Dict[str, any]] | None = None) -> None:
+        self.factory = factory
+        self.max_idle: int = max_idle
+        # Whatever else the factory reads when it builds a YoutubeDL, e.g. the postprocessors it adds
+        self.settings: Callable[[], Dict[str, any]] | None = settings
+        self.__idle: Dict[str, List[DownloadSession]] = {}
+        self.__lock = threading.Lock()
+
+    def key(self, opts: Dict[str, any]) -> str:
+        key = {name: value for name, value in opts.items() if name not in self.JOB_OPTIONS}
+        if self.settings is not None:
+            key['settings'] = self.settings()
+        return json.dumps(key, sort_keys=True, default=repr)
+
+    @contextlib.contextmanager
+    def session(self, opts: Dict[str, any]) -> Iterator[any]:
+        key = self.key(opts)
+        with self.__lock:
+            idle = self.__idle.get(key)
+            session = idle.pop() if idle else None
+        if session is None:
+            session = DownloadSession(self.factory({name: value for name, value in opts.items()
+                                                    if name not in self.JOB_OPTIONS}))
+
+        self.prepare(session, opts)
+        try:
+            yield session.ydl
+        except BaseException:
+            # A failed download may leave the session in any state, it is not reused
+            session.ydl.close()
+            raise
+        finally:
+            session.progress_hooks, session.post_hooks = [], []
+        self.release(key, session)
+
+    def prepare(self, session: DownloadSession, opts: Dict[str, any]) -> None:
+        # YoutubeDL reads these from its params on every download
+        params = session.ydl.params
+        params['outtmpl'] = {**params['outtmpl'], **opts.get('outtmpl', {})}
+        for name in ('final_ext', 'download_ranges'):
+            if name in opts:
+                params[name] = opts[name]
+            else:
+                params.pop(name, None)
+        session.progress_hooks = list(opts.get('progress_hooks', []))
+        session.post_hooks = list(opts.get('post_hooks', []))
+
+    def release(self, key: str, session: DownloadSession) -> None:
+        with self.__lock:
+            if sum(len(idle) for idle in self.__idle.values()) < self.max_idle:
+                self.__idle.setdefault(key, []).append(session)
+                return
+        session.ydl.close()
+
+    def close(self) -> None:
+        with self.__lock:
+            sessions = [session for idle in self.__idle.values() for session in idle]
+            self.__idle.clear()
+        for session in sessions:
+            session.ydl.close()
@@ -0,0 +1,51 @@
+import subprocess
+from typing import Iterator, Tuple
+
+# numpy is an optional dependency (pip install "MP3 YouTube Downloader[silence]"), imported where used
+
+def read_pcm_blocks(filepath: str, sample_rate: int = 8000, block_samples: int = 8000 * 60) -> Iterator['numpy.ndarray']:
+    # ffmpeg decodes straight into downsampled mono 16 bit PCM, read a block at a time
+    # so hour long files never have to fit in memory
+    import numpy as np
+    process = subprocess.Popen(['ffmpeg', '-hide_banner', '-loglevel', 'error', '-i', filepath,
+                                '-ac', '1', '-ar', str(sample_rate), '-f', 's16le', '-'],
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    try:
+        while block := process.stdout.read(block_samples * 2):
+            yield np.frombuffer(block, dtype=np.int16)
+    finally:
+        process.stdout.close()
+        stderr = process.stderr.read().decode(errors='replace')
+        if process.wait() != 0:
+            if 'No such file or directory' in stderr:
+                raise FileNotFoundError(f'No such file: {filepath}')
+            raise ValueError(f'ffmpeg could not decode {filepath}: {stderr.strip()}')
+
+def detect_audio_bounds(filepath: str, threshold_db: float = -50.0, window_ms: int = 50,
+                        sample_rate: int = 8000) -> Tuple[int, int]:
+    # Returns (start, end) in milliseconds of the audio between the leading and trailing
+    # silence, where silence is every window whose RMS level is below threshold_db (dBFS)
+    import numpy as np
+    window_samples = sample_rate * window_ms // 1000
+    # Blocks hold a whole number of windows, so windows never straddle two blocks
+    block_samples = window_samples * (sample_rate * 60 // window_samples)
+    threshold = (10 ** (threshold_db / 20) * 32768) ** 2
+
+    first_window = None
+    last_window = None
+    windows_read = 0
+    for block in read_pcm_blocks(filepath, sample_rate, block_samples):
+        windows = len(block) // window_samples
+        if windows == 0:
+            continue
+        samples = block[:windows * window_samples].astype(np.float32).reshape(windows, window_samples)
+        loud = np.flatnonzero(np.mean(samples * samples, axis=1) >= threshold)
+        if len(loud) > 0:
+            if first_window is None:
+                first_window = windows_read + loud[0]
+            last_window = windows_read + loud[-1]
+        windows_read += windows
+
+    if first_window is None:
+        raise ValueError(f'No audio louder than {threshold_db} dB found! >:(')
+    return int(first_window * window_ms), int((last_window + 1) * window_ms)
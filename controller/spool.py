@@ -0,0 +1,131 @@
+import os
+import json
+import time
+import uuid
+import socket
+from typing import Dict, List
+from utils.utils import sanitize_filename
+
+class Lease:
+    def __init__(self, name: str, filename: str, expires: float, body: Dict[str, any]) -> None:
+        self.name: str = name
+        # Name of the job file in leased/, it changes with every renewal
+        self.filename: str = filename
+        self.expires: float = expires
+        self.body: Dict[str, any] = body
+        self.lost: bool = False
+
+class Spool:
+    # Shared directory of job files, e.g. on a NAS. A job file moves between the directories by rename,
+    # which is atomic on one file system (NFS included), so exactly one worker wins every claim.
+    # Leases are renames as well: the expiry is part of the leased file's name, renewing renames it
+    # again, so a worker that reclaims an expired lease and the worker renewing it can't both succeed.
+    # Expiries are compared across hosts, their clocks have to be synchronized (NTP)
+    DIRECTORIES = ('pending', 'leased', 'done', 'failed', 'status', 'tmp')
+
+    def __init__(self, directory: str, worker_id: str | None = None, lease_seconds: float = 300) -> None:
+        self.directory: str = directory
+        self.worker_id: str = sanitize_filename(worker_id or f'{socket.gethostname()}-{os.getpid()}').replace('~', '_')
+        self.lease_seconds: float = lease_seconds
+        for name in Spool.DIRECTORIES:
+            os.makedirs(os.path.join(self.directory, name), exist_ok=True)
+
+    def path(self, directory: str, filename: str) -> str:
+        return os.path.join(self.directory, directory, filename)
+
+    def __write(self, path: str, data: Dict[str, any]) -> None:
+        # Written to the spool's tmp directory first, readers never see half a file
+        temp_path = self.path('tmp', f'{uuid.uuid4().hex}.json')
+        with open(temp_path, 'w') as f:
+            json.dump(data, f, default=str)
+        os.replace(temp_path, path)
+
+    def submit(self, body: Dict[str, any]) -> str:
+        # Names sort by submission time, workers claim the oldest job first
+        name = f'{time.time_ns()}-{uuid.uuid4().hex[:8]}'
+        self.__write(self.path('pending', f'{name}.json'), body)
+        return name
+
+    def lease_filename(self, name: str, expires: float) -> str:
+        return f'{name}~{self.worker_id}~{int(expires)}'
+
+    @staticmethod
+    def parse_lease_filename(filename: str) -> tuple | None:
+        # (name, worker id, expiry)
+        parts = filename.rsplit('~', 2)
+        if len(parts) != 3 or not parts[2].isdigit():
+            return None
+        return parts[0], parts[1], int(parts[2])
+
+    def claim(self) -> Lease | None:
+        for filename in sorted(os.listdir(self.path('pending', ''))):
+            if not filename.endswith('.json'):
+                continue
+            name = filename[:-len('.json')]
+            expires = time.time() + self.lease_seconds
+            lease_filename = self.lease_filename(name, expires)
+            try:
+                os.rename(self.path('pending', filename), self.path('leased', lease_filename))
+            except FileNotFoundError:
+                # Another worker was faster
+                continue
+            try:
+                with open(self.path('leased', lease_filename), 'r') as f:
+                    body = json.load(f)
+            except ValueError as e:
+                body = {'error': f'Invalid job file: {e}'}
+            # Counted on the claim, so a job that takes its workers down still runs out of attempts
+            body['attempts'] = body.get('attempts', 0) + 1
+            self.__write(self.path('leased', lease_filename), body)
+            return Lease(name, lease_filename, expires, body)
+        return None
+
+    def renew(self, lease: Lease) -> bool:
+        # False once the lease expired and another worker reclaimed it
+        expires = time.time() + self.lease_seconds
+        filename = self.lease_filename(lease.name, expires)
+        try:
+            os.rename(self.path('leased', lease.filename), self.path('leased', filename))
+        except FileNotFoundError:
+            lease.lost = True
+            return False
+        lease.filename, lease.expires = filename, expires
+        return True
+
+    def reclaim_expired(self) -> List[str]:
+        # Leases of dead workers go back to pending
+        reclaimed = []
+        now = time.time()
+        for filename in os.listdir(self.path('leased', '')):
+            parsed = self.parse_lease_filename(filename)
+            if parsed is None or parsed[2] >= now:
+                continue
+            try:
+                os.rename(self.path('leased', filename), self.path('pending', f'{parsed[0]}.json'))
+            except FileNotFoundError:
+                continue
+            reclaimed.append(parsed[0])
+        return reclaimed
+
+    def finish(self, lease: Lease, directory: str) -> bool:
+        # Moves the job to done, failed or back to pending. The lease is taken out of leased/ first, so a
+        # reclaim that happens meanwhile either wins completely or not at all
+        temp_path = self.path('tmp', f'{lease.name}~{self.worker_id}.json')
+        try:
+            os.rename(self.path('leased', lease.filename), temp_path)
+        except FileNotFoundError:
+            lease.lost = True
+            return False
+        self.__write(temp_path, lease.body)
+        os.rename(temp_path, self.path(directory, f'{lease.name}.json'))
+        return True
+
+    def write_status(self, name: str, status: Dict[str, any]) -> None:
+        self.__write(self.path('status', f'{name}.json'), status)
+
+    def read_status(self, name: str) -> Dict[str, any] | None:
+        try:
+            with open(self.path('status', f'{name}.json'), 'r') as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
@@ -0,0 +1,13 @@
+from enum import Enum
+
+class State(Enum):
+    IDLE = 0
+    REQUEST = 1
+    DOWNLOADING = 2
+    POSTPROCESSING = 3
+    DONE = 4
+    TRIMMED = 5
+    SAVE_DIR_CHANGED = 6
+    ERROR = 7
+    SKIPPED = 8
+    SPLIT = 9
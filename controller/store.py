@@ -0,0 +1,133 @@
+import os
+import json
+import shutil
+import hashlib
+import threading
+from typing import Dict, Tuple
+from utils.utils import atomic_write
+
+# ioctl that clones the blocks of one file into another (btrfs, XFS), see ioctl_ficlone(2)
+FICLONE = 0x40049409
+
+def reflink(source: str, destination: str) -> None:
+    import fcntl
+    with open(source, 'rb') as src, open(destination, 'wb') as dst:
+        fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+
+def link(source: str, destination: str) -> str:
+    # Hardlink, then reflink, then a plain copy when the file system supports neither.
+    # Goes through a temporary file so an existing destination is replaced in one step
+    temp_path = destination + '.link.tmp'
+    for method, make_link in (('hardlink', os.link), ('reflink', reflink), ('copy', shutil.copy2)):
+        try:
+            make_link(source, temp_path)
+            break
+        except (OSError, ImportError):
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+    else:
+        raise OSError(f'Could not link {source} to {destination}')
+    os.replace(temp_path, destination)
+    return method
+
+class ContentStore:
+    # Finished files are kept once under the hash of what they were made from, the files in the
+    # save directories are links to them. Only saves space when both are on the same file system
+    def __init__(self, directory: str) -> None:
+        self.directory: str = directory
+        self.__lock = threading.Lock()
+
+    @staticmethod
+    def key(archive_id: str, codec: str, quality: str, trim: str) -> str:
+        return hashlib.sha256(json.dumps([archive_id, codec, quality, trim]).encode()).hexdigest()[:32]
+
+    def __paths(self, key: str) -> Tuple[str, str]:
+        # Sharded by the first two characters so no directory gets too large
+        base = os.path.join(self.directory, key[:2], key)
+        return base, base + '.json'
+
+    def __read_info(self, info_path: str) -> Dict[str, any] | None:
+        try:
+            with open(info_path, 'r') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def __write_info(self, info_path: str, info: Dict[str, any]) -> None:
+        with atomic_write(info_path) as f:
+            json.dump(info, f)
+
+    def __add_reference(self, stored_path: str, path: str, method: str) -> None:
+        # Every file in a save directory made from a stored file is recorded with how it was linked,
+        # only hardlinks show up in st_nlink
+        info_path = os.path.splitext(stored_path)[0] + '.json'
+        info = self.__read_info(info_path)
+        if info is not None:
+            info.setdefault('links', {})[os.path.abspath(path)] = method
+            self.__write_info(info_path, info)
+
+    def lookup(self, key: str) -> Tuple[str, str] | None:
+        # The stored file and the name it was first saved under, without extension
+        base, info_path = self.__paths(key)
+        info = self.__read_info(info_path)
+        if info is None:
+            return None
+        stored_path = base + info['ext']
+        return (stored_path, info['name']) if os.path.exists(stored_path) else None
+
+    def add(self, key: str, filepath: str) -> str:
+        base, info_path = self.__paths(key)
+        name, ext = os.path.splitext(os.path.basename(filepath))
+        stored_path = base + ext
+        with self.__lock:
+            os.makedirs(os.path.dirname(base), exist_ok=True)
+            if not os.path.exists(stored_path):
+                method = link(filepath, stored_path)
+                self.__write_info(info_path, {'name': name, 'ext': ext, 'links': {os.path.abspath(filepath): method}})
+            elif not os.path.samefile(stored_path, filepath):
+                # Made again from the same source, the new copy is swapped for a link to the stored one
+                self.__add_reference(stored_path, filepath, link(stored_path, filepath))
+        return stored_path
+
+    def link_to(self, stored_path: str, destination: str) -> str:
+        os.makedirs(os.path.dirname(destination) or '.', exist_ok=True)
+        with self.__lock:
+            method = link(stored_path, destination)
+            self.__add_reference(stored_path, destination, method)
+        return method
+
+    @staticmethod
+    def is_referenced(stored_path: str, path: str, method: str) -> bool:
+        # A hardlink has to still be the same file, the path may have been replaced since. Reflinks and
+        # copies are independent files, they count as long as they exist
+        try:
+            return os.path.samefile(stored_path, path) if method == 'hardlink' else os.path.exists(path)
+        except OSError:
+            return False
+
+    def collect_garbage(self) -> Dict[str, int]:
+        # A stored file is removed once none of the files recorded as made from it is left
+        removed, freed = 0, 0
+        with self.__lock:
+            for root, _, files in os.walk(self.directory):
+                for file in files:
+                    if not file.endswith('.json'):
+                        continue
+                    info_path = os.path.join(root, file)
+                    info = self.__read_info(info_path)
+                    if info is None or 'links' not in info:
+                        # Incomplete, or stored before references were recorded: kept, it may be in use
+                        continue
+                    stored_path = os.path.splitext(info_path)[0] + info['ext']
+                    links = {path: method for path, method in info['links'].items()
+                             if self.is_referenced(stored_path, path, method)}
+                    if links:
+                        if links != info['links']:
+                            self.__write_info(info_path, {**info, 'links': links})
+                        continue
+                    if os.path.exists(stored_path):
+                        freed += os.path.getsize(stored_path)
+                        os.remove(stored_path)
+                    os.remove(info_path)
+                    removed += 1
+        return {'removed': removed, 'freed_bytes': freed}
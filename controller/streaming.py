@@ -0,0 +1,127 @@
+import os
+import sys
+import time
+import threading
+import subprocess
+from typing import Callable, Dict, List
+from controller.tags import get_cover_args
+from controller.trim import format_ffmpeg_time
+
+# yt_dlp is imported where used, like in the controller
+
+# Protocols whose bytes can be fed to ffmpeg as they arrive, fragmented formats (DASH, HLS) can't
+STREAMABLE_PROTOCOLS = ('http', 'https')
+
+def is_streamable(info: Dict[str, any]) -> bool:
+    # A single format, merged video and audio formats are downloaded separately
+    return info.get('protocol') in STREAMABLE_PROTOCOLS and not info.get('requested_formats') and bool(info.get('url'))
+
+def get_encoder_args(source_codec: str | None, codec: str, quality: str) -> List[str]:
+    # The choices FFmpegExtractAudio makes, stream copy when the source already has the codec
+    from yt_dlp.postprocessor.ffmpeg import ACODECS
+    if source_codec == codec or (source_codec == 'aac' and codec == 'm4a'):
+        return ['-acodec', 'copy', *ACODECS[codec][2]]
+    _, encoder, more_opts = ACODECS[codec]
+    args = ['-acodec', encoder] if encoder else []
+    args += more_opts
+    if quality and float(quality) > 10:
+        args += ['-b:a', f'{float(quality):g}k']
+    elif quality and encoder == 'libmp3lame':
+        args += ['-q:a', quality]
+    elif quality and encoder == 'libvorbis':
+        args += ['-q:a', f'{10 - float(quality):g}']
+    return args
+
+def stream_transcode(ydl, info: Dict[str, any], output_path: str, codec: str, quality: str,
+                     start: int = 0, end: int = 0, chunk_size: int = 10485760,
+                     progress: Callable[[int, int | None, int], None] | None = None,
+                     metadata_args: List[str] | None = None, cover: str | None = None) -> None:
+    # The selected format is fetched in ranges of chunk_size and written into a running ffmpeg, which
+    # transcodes (and trims, start and end in milliseconds) while the rest is still downloading.
+    # Nothing but the output is written to disk, tags (ffmpeg -metadata options) and cover included
+    from yt_dlp.networking import Request
+    from yt_dlp.networking.exceptions import HTTPError, RequestError
+    from yt_dlp.utils import DownloadError
+    args = ['ffmpeg', '-y', '-hide_banner', '-loglevel', 'error', '-nostats', '-progress', 'pipe:1', '-i', 'pipe:0']
+    if cover is not None:
+        # The cover is shifted to the trim start, output -ss would drop it otherwise
+        args += ['-itsoffset', format_ffmpeg_time(start), '-i', cover, '-map', '0:a:0', *get_cover_args(1)]
+    else:
+        args += ['-vn']
+    args += metadata_args or []
+    if start != 0:
+        args += ['-ss', format_ffmpeg_time(start)]
+    if end != 0:
+        args += ['-to', format_ffmpeg_time(end)]
+    temp_path = output_path + '.part' + os.path.splitext(output_path)[1]
+    args += get_encoder_args(info.get('acodec'), codec, quality) + [temp_path]
+
+    process = subprocess.Popen(args, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    total = info.get('filesize') or info.get('filesize_approx')
+    downloaded = 0
+    encoded = 0
+
+    def read_progress() -> None:
+        # ffmpeg's -progress output, key=value lines
+        nonlocal encoded
+        for line in process.stdout:
+            if line.startswith(b'out_time_us=') and line[12:].strip().isdigit():
+                encoded = int(line[12:]) // 1000
+    progress_thread = threading.Thread(target=read_progress, daemon=True)
+    progress_thread.start()
+
+    started = time.monotonic()
+    try:
+        while total is None or downloaded < total:
+            headers = {**info.get('http_headers', {}), 'Range': f'bytes={downloaded}-{downloaded + chunk_size - 1}'}
+            try:
+                response = ydl.urlopen(Request(info['url'], headers=headers))
+            except HTTPError as e:
+                # The file ended exactly at the end of the last chunk
+                if e.status == 416 and downloaded > 0:
+                    break
+                raise
+            chunk_start = downloaded
+            if response.status == 200:
+                # The server ignored the range, the whole file comes in this response
+                chunk_size = None
+                total = total or int(response.headers.get('Content-Length') or 0) or None
+            elif total is None and '/' in response.headers.get('Content-Range', ''):
+                total = int(response.headers['Content-Range'].rsplit('/', 1)[1])
+
+            while block := response.read(65536):
+                process.stdin.write(block)
+                downloaded += len(block)
+                # Same throttling as yt_dlp's downloaders, 'ratelimit' may change while running
+                rate_limit = ydl.params.get('ratelimit')
+                elapsed = time.monotonic() - started
+                if rate_limit and elapsed > 0 and downloaded / elapsed > rate_limit:
+                    time.sleep(downloaded / rate_limit - elapsed)
+                if progress is not None:
+                    progress(downloaded, total, encoded)
+            if chunk_size is None or downloaded - chunk_start < chunk_size:
+                break
+        process.stdin.close()
+    except BrokenPipeError:
+        # ffmpeg stops reading once it is past the trim end, the rest is not needed
+        pass
+    except BaseException as e:
+        process.kill()
+        process.wait()
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        # Network and pipe errors fail the job like the same errors in a regular download
+        if isinstance(e, (RequestError, OSError)):
+            raise DownloadError(f"Could not stream {info.get('webpage_url', info['url'])}: {e}", sys.exc_info()) from e
+        raise
+
+    stderr = process.stderr.read().decode(errors='replace')
+    process.wait()
+    progress_thread.join()
+    if process.returncode != 0:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise ValueError(f"ffmpeg could not transcode the stream of {info.get('webpage_url', info['url'])}: {stderr.strip()}")
+    os.replace(temp_path, output_path)
+    if progress is not None:
+        progress(downloaded, total, encoded)
@@ -0,0 +1,108 @@
+import os
+import subprocess
+import threading
+from typing import Dict, List
+from utils.utils import sanitize_filename
+
+# Extensions whose containers take a cover picture (ID3 APIC, MP4 covr, FLAC PICTURE)
+COVER_EXTENSIONS = ('mp3', 'm4a', 'flac')
+
+def get_metadata(info: Dict[str, any]) -> Dict[str, str]:
+    # The tags yt_dlp's FFmpegMetadata would write, from the info dict of the video
+    artists = info.get('artists') or info.get('creators')
+    metadata = {
+        'title': info.get('track') or info.get('title'),
+        'artist': ', '.join(artists) if artists else info.get('artist') or info.get('uploader') or info.get('channel'),
+        'album': info.get('album') or info.get('playlist_title'),
+        'date': info.get('release_date') or info.get('upload_date'),
+        'purl': info.get('webpage_url'),
+        'comment': info.get('webpage_url'),
+    }
+    return {key: str(value) for key, value in metadata.items() if value}
+
+def get_metadata_args(info: Dict[str, any]) -> List[str]:
+    # ffmpeg output options
+    return [arg for key, value in get_metadata(info).items() for arg in ('-metadata', f'{key}={value}')]
+
+def get_cover_args(input_index: int) -> List[str]:
+    # ffmpeg output options that add the picture of input input_index as the cover
+    return ['-map', f'{input_index}:v:0', '-c:v', 'copy', '-disposition:v:0', 'attached_pic',
+            '-metadata:s:v:0', 'comment=Cover (front)']
+
+def extract_cover(filepath: str, cover_path: str) -> bool:
+    # Only the picture stream is read, False when the file has none
+    process = subprocess.run(['ffmpeg', '-y', '-hide_banner', '-loglevel', 'error', '-i', filepath, '-map', '0:v:0',
+                              '-frames:v', '1', '-c:v', 'mjpeg', '-q:v', '2', '-f', 'image2', cover_path],
+                             capture_output=True)
+    return process.returncode == 0 and os.path.exists(cover_path)
+
+class ThumbnailCache:
+    # Cover art per video, fetched once and kept as JPEG, so every format, trim and re-download of the
+    # same video reuses it. The least recently used pictures are evicted beyond max_bytes
+    def __init__(self, directory: str, max_bytes: int = 256 * 1024 * 1024) -> None:
+        self.directory: str = directory
+        self.max_bytes: int = max_bytes
+        self.__lock = threading.Lock()
+        # A video is fetched by one worker at a time, the others wait and find it cached
+        self.__fetching: Dict[str, threading.Lock] = {}
+
+    def get_path(self, info: Dict[str, any]) -> str:
+        return os.path.join(self.directory, sanitize_filename(f"{info.get('extractor_key', '').lower()}-{info['id']}") + '.jpg')
+
+    def get(self, ydl, info: Dict[str, any]) -> str | None:
+        # Path of the cover of the video, None when it has no thumbnail or it could not be fetched
+        thumbnails = [thumbnail for thumbnail in info.get('thumbnails') or [] if thumbnail.get('url')]
+        if not thumbnails and info.get('thumbnail'):
+            thumbnails = [{'url': info['thumbnail']}]
+        if not info.get('id') or not thumbnails:
+            return None
+
+        path = self.get_path(info)
+        with self.__lock:
+            fetching = self.__fetching.setdefault(path, threading.Lock())
+        with fetching:
+            if os.path.exists(path):
+                # Marks it as recently used
+                os.utime(path)
+                return path
+            # yt_dlp sorts thumbnails from worst to best
+            return self.__fetch(ydl, thumbnails[-1]['url'], path)
+
+    def __fetch(self, ydl, url: str, path: str) -> str | None:
+        os.makedirs(self.directory, exist_ok=True)
+        download_path = path + '.download'
+        temp_path = path + '.tmp.jpg'
+        try:
+            with ydl.urlopen(url) as response, open(download_path, 'wb') as f:
+                while block := response.read(65536):
+                    f.write(block)
+            # Thumbnails are mostly WebP, which no audio container takes as a cover
+            process = subprocess.run(['ffmpeg', '-y', '-hide_banner', '-loglevel', 'error', '-i', download_path,
+                                      '-frames:v', '1', '-q:v', '2', '-f', 'image2', temp_path], capture_output=True)
+            if process.returncode != 0:
+                raise ValueError(process.stderr.decode(errors='replace').strip())
+            os.replace(temp_path, path)
+        except Exception as e:
+            # A download without a cover is better than no download
+            ydl.report_warning(f'Could not fetch the thumbnail {url}: {e}')
+            return None
+        finally:
+            for leftover in (download_path, temp_path):
+                if os.path.exists(leftover):
+                    os.remove(leftover)
+        self.evict()
+        return path
+
+    def evict(self) -> None:
+        with self.__lock:
+            entries = []
+            for entry in os.scandir(self.directory):
+                if entry.name.endswith('.jpg') and not entry.name.endswith('.tmp.jpg'):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                os.remove(path)
+                total -= size
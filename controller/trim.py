@@ -0,0 +1,176 @@
+import os
+import re
+import shutil
+import subprocess
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, List
+from utils.utils import get_time_milliseconds, parse_timestamp, sanitize_filename
+
+CHAPTER_LINE = re.compile(r'^\s*\[?((?:\d+:)?\d+:\d+(?:\.\d+)?)\]?(?:\s*-\s*((?:\d+:)?\d+:\d+(?:\.\d+)?))?\s*[-–:]?\s*(.*)$')
+
+# ffmpeg muxers for the extensions FFmpegExtractAudio writes, when they are named differently
+EXPORT_FORMATS = {'m4a': 'ipod', 'aac': 'adts'}
+
+def ffmpeg_available() -> bool:
+    return shutil.which('ffmpeg') is not None
+
+def format_ffmpeg_time(milliseconds: int) -> str:
+    return f'{milliseconds / 1000:.3f}'
+
+def get_export_format(filepath: str) -> str:
+    # Decoded audio is exported in the format of the file it came from
+    extension = os.path.splitext(filepath)[1].lstrip('.').lower() or 'mp3'
+    return EXPORT_FORMATS.get(extension, extension)
+
+def get_audio_duration(filepath: str) -> int:
+    # ffmpeg only reads the headers here, nothing is decoded. Returns milliseconds
+    process = subprocess.run(['ffmpeg', '-hide_banner', '-i', filepath], capture_output=True, text=True)
+    match = re.search(r'Duration: (\d+):(\d+):(\d+(?:\.\d+)?)', process.stderr)
+    if match is None:
+        if 'No such file or directory' in process.stderr:
+            raise FileNotFoundError(f'No such file: {filepath}')
+        raise ValueError(f'Could not read the duration of {filepath}! >:(')
+    hours, minutes, seconds = match.groups()
+    return int((int(hours) * 3600 + int(minutes) * 60 + float(seconds)) * 1000)
+
+def trim_stream_copy(source: str, destination: str, start: int, end: int) -> None:
+    # Cuts on frame boundaries without decoding, -map 0 keeps cover art and tags
+    args = ['ffmpeg', '-y', '-hide_banner', '-loglevel', 'error', '-ss', format_ffmpeg_time(start)]
+    if end != 0:
+        args += ['-to', format_ffmpeg_time(end)]
+    args += ['-i', source, '-map', '0', '-c', 'copy', destination]
+
+    process = subprocess.run(args, capture_output=True, text=True)
+    if process.returncode != 0:
+        raise ValueError(f'ffmpeg could not trim {source}: {process.stderr.strip()}')
+
+def parse_cue_time(time: str) -> int:
+    # Cue sheets use mm:ss:ff with 75 frames per second. Returns milliseconds
+    minutes, seconds, frames = (int(part) for part in time.split(':'))
+    return (minutes * 60 + seconds) * 1000 + frames * 1000 // 75
+
+def parse_cue_sheet(text: str) -> List[Dict[str, any]]:
+    # Reads either a .cue sheet or chapter style lines such as "01:02:03 Title" or
+    # "01:02:03 - 01:05:00 Title". Segments without an end run until the next one starts
+    # and the last one until the end of the file (end 0)
+    segments = []
+    if re.search(r'^\s*TRACK\s+\d+', text, re.MULTILINE):
+        title = ''
+        for line in text.splitlines():
+            line = line.strip()
+            if line.startswith('TRACK'):
+                title = ''
+            elif line.startswith('TITLE'):
+                title = line[len('TITLE'):].strip().strip('"')
+            elif line.startswith('INDEX 01'):
+                segments.append({'start': parse_cue_time(line.split()[2]), 'end': 0, 'title': title})
+    else:
+        for line in text.splitlines():
+            match = CHAPTER_LINE.match(line)
+            if match is None:
+                continue
+            start, end, title = match.groups()
+            segments.append({'start': get_time_milliseconds(parse_timestamp(start)),
+                             'end': get_time_milliseconds(parse_timestamp(end)) if end else 0,
+                             'title': title.strip()})
+
+    for segment, next_segment in zip(segments, segments[1:]):
+        if segment['end'] == 0:
+            segment['end'] = next_segment['start']
+    for index, segment in enumerate(segments, start=1):
+        if segment['title'] == '':
+            segment['title'] = f'Track {index:02d}'
+    return segments
+
+def chapters_to_segments(chapters: List[Dict[str, any]], start: int = 0, end: int = 0,
+                         album: str = '') -> List[Dict[str, any]]:
+    # Turns yt_dlp chapters (seconds) into segments (milliseconds). When only the section
+    # start-end was downloaded, chapters are clipped to it and shifted to start at 0
+    segments = []
+    for chapter in chapters:
+        chapter_start = int(chapter['start_time'] * 1000)
+        chapter_end = int(chapter['end_time'] * 1000)
+        if chapter_end <= start or (end != 0 and chapter_start >= end):
+            continue
+        chapter_end = chapter_end if end == 0 else min(chapter_end, end)
+        segments.append({'start': max(chapter_start, start) - start,
+                         'end': chapter_end - start,
+                         'title': chapter.get('title') or f'Chapter {len(segments) + 1:02d}',
+                         'album': album})
+    return segments
+
+def get_segment_paths(source: str, segments: List[Dict[str, any]], output_dir: str | None = None) -> List[str]:
+    directory, file = os.path.split(source)
+    file_no_extension, extension = os.path.splitext(file)
+    return [os.path.join(output_dir or directory, f"{file_no_extension} - {index:02d} - {sanitize_filename(segment['title'])}{extension}")
+            for index, segment in enumerate(segments, start=1)]
+
+def validate_segments(segments: List[Dict[str, any]], duration: int) -> None:
+    for segment in segments:
+        if segment['end'] != 0 and segment['end'] <= segment['start']:
+            raise ValueError(f"Segment {segment['title']} ends before it starts! >:(")
+        if segment['start'] >= duration:
+            raise ValueError(f"Segment {segment['title']} starts after the end of the audio! >:(")
+
+def split_stream_copy(source: str, segments: List[Dict[str, any]], output_paths: List[str]) -> None:
+    # A single ffmpeg process with one output per segment, so the source is only read once
+    args = ['ffmpeg', '-y', '-hide_banner', '-loglevel', 'error', '-i', source]
+    for index, (segment, output_path) in enumerate(zip(segments, output_paths), start=1):
+        args += ['-map', '0:a', '-c', 'copy', '-ss', format_ffmpeg_time(segment['start'])]
+        if segment['end'] != 0:
+            args += ['-to', format_ffmpeg_time(segment['end'])]
+        args += ['-metadata', f"title={segment['title']}", '-metadata', f'track={index}/{len(segments)}']
+        if segment.get('album'):
+            args += ['-metadata', f"album={segment['album']}"]
+        args.append(output_path)
+
+    process = subprocess.run(args, capture_output=True, text=True)
+    if process.returncode != 0:
+        raise ValueError(f'ffmpeg could not split {source}: {process.stderr.strip()}')
+
+def split_decode(source: str, segments: List[Dict[str, any]], output_paths: List[str]) -> None:
+    # Sample accurate, the source is decoded once and every segment is sliced from it
+    from pydub import AudioSegment
+    audio = AudioSegment.from_file(source)
+    validate_segments(segments, len(audio))
+
+    export_format = get_export_format(source)
+    for index, (segment, output_path) in enumerate(zip(segments, output_paths), start=1):
+        part = audio[segment['start']:] if segment['end'] == 0 else audio[segment['start']:segment['end']]
+        tags = {'title': segment['title'], 'track': f'{index}/{len(segments)}'}
+        if segment.get('album'):
+            tags['album'] = segment['album']
+        part.export(output_path, format=export_format, tags=tags)
+
+def split_file(source: str, segments: List[Dict[str, any]], output_dir: str | None = None,
+               sample_accurate: bool = False) -> List[str]:
+    # Module level so it can run in a process pool
+    if not os.path.exists(source):
+        raise FileNotFoundError(f'No such file: {source}')
+    if not segments:
+        raise ValueError('No segments to split! >:(')
+    output_paths = get_segment_paths(source, segments, output_dir)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+
+    if sample_accurate or not ffmpeg_available():
+        split_decode(source, segments, output_paths)
+    else:
+        validate_segments(segments, get_audio_duration(source))
+        split_stream_copy(source, segments, output_paths)
+    return output_paths
+
+def batch_split(files: Dict[str, List[Dict[str, any]]], output_dir: str | None = None,
+                sample_accurate: bool = False, max_workers: int | None = None) -> Dict[str, List[str] | Exception]:
+    # Every source file is split in its own process. Failures are returned per file instead
+    # of aborting the whole batch
+    results = {}
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(split_file, source, segments, output_dir, sample_accurate): source
+                   for source, segments in files.items()}
+        for future in as_completed(futures):
+            try:
+                results[futures[future]] = future.result()
+            except (FileNotFoundError, ValueError) as e:
+                results[futures[future]] = e
+    return results
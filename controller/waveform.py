@@ -0,0 +1,105 @@
+import os
+import json
+import struct
+from typing import Dict, List
+from controller.silence import read_pcm_blocks
+from utils.utils import atomic_write
+
+# numpy is an optional dependency (pip install "MP3 YouTube Downloader[waveform]"), imported where used
+
+PEAKS_MAGIC = b'PEAKS1\n'
+
+def get_peaks_path(filepath: str) -> str:
+    # The peak file is kept next to the audio it was computed from
+    return filepath + '.peaks'
+
+def build_peaks(filepath: str, peaks_path: str, sample_rate: int = 8000, window: int = 64, factor: int = 4) -> None:
+    # One streaming pass over the decoded audio for the finest level, min and max of every window
+    # of samples. Every coarser level merges factor bins of the one before, until a level fits a screen
+    import numpy as np
+    block_samples = window * (sample_rate * 60 // window)
+    blocks = []
+    samples = 0
+    for block in read_pcm_blocks(filepath, sample_rate, block_samples):
+        samples += len(block)
+        bins = -(-len(block) // window)
+        # The last window of the file is padded with its own last sample, which leaves min and max alone
+        block = np.pad(block, (0, bins * window - len(block)), mode='edge').reshape(bins, window)
+        blocks.append(np.stack((block.min(axis=1), block.max(axis=1)), axis=1))
+    if not blocks:
+        raise ValueError(f'No audio in {filepath}! >:(')
+
+    levels = [np.concatenate(blocks)]
+    while len(levels[-1]) > 2048:
+        previous = levels[-1]
+        bins = -(-len(previous) // factor)
+        padded = np.pad(previous, ((0, bins * factor - len(previous)), (0, 0)), mode='edge').reshape(bins, factor, 2)
+        levels.append(np.stack((padded[:, :, 0].min(axis=1), padded[:, :, 1].max(axis=1)), axis=1))
+
+    stat = os.stat(filepath)
+    header = {'sample_rate': sample_rate, 'samples': samples,
+              'source_size': stat.st_size, 'source_mtime': stat.st_mtime, 'levels': []}
+    offset = 0
+    for index, level in enumerate(levels):
+        header['levels'].append({'window': window * factor ** index, 'bins': len(level), 'offset': offset})
+        offset += level.nbytes
+
+    header_bytes = json.dumps(header).encode()
+    with atomic_write(peaks_path, 'wb') as f:
+        f.write(PEAKS_MAGIC + struct.pack('<I', len(header_bytes)) + header_bytes)
+        for level in levels:
+            f.write(level.astype('<i2').tobytes())
+
+class WaveformPeaks:
+    # Multi-resolution min/max peaks of an audio file, memory mapped, so zooming into a long file
+    # only reads the bins that are drawn
+    def __init__(self, peaks_path: str) -> None:
+        import numpy as np
+        with open(peaks_path, 'rb') as f:
+            if f.read(len(PEAKS_MAGIC)) != PEAKS_MAGIC:
+                raise ValueError(f'{peaks_path} is not a peak file! >:(')
+            header_length, = struct.unpack('<I', f.read(4))
+            self.header: Dict[str, any] = json.loads(f.read(header_length))
+        data_offset = len(PEAKS_MAGIC) + 4 + header_length
+        self.levels: List[Dict[str, any]] = [
+            {'window': level['window'],
+             'peaks': np.memmap(peaks_path, dtype='<i2', mode='r', offset=data_offset + level['offset'], shape=(level['bins'], 2))}
+            for level in self.header['levels']]
+
+    @classmethod
+    def open(cls, filepath: str) -> 'WaveformPeaks':
+        # Computed once, recomputed when the audio file changed since
+        if not os.path.exists(filepath):
+            raise FileNotFoundError(f'No such file: {filepath}')
+        peaks_path = get_peaks_path(filepath)
+        try:
+            peaks = cls(peaks_path)
+            stat = os.stat(filepath)
+            if peaks.header['source_size'] == stat.st_size and peaks.header['source_mtime'] == stat.st_mtime:
+                return peaks
+        except (FileNotFoundError, ValueError, KeyError, struct.error):
+            pass
+        build_peaks(filepath, peaks_path)
+        return cls(peaks_path)
+
+    @property
+    def duration(self) -> int:
+        # Milliseconds
+        return self.header['samples'] * 1000 // self.header['sample_rate']
+
+    def get_peaks(self, start: int, end: int, width: int) -> 'numpy.ndarray':
+        # (min, max) per pixel column between start and end (milliseconds), as fractions of full scale
+        import numpy as np
+        samples_per_ms = self.header['sample_rate'] / 1000
+        samples = max((end - start) * samples_per_ms, 1)
+        # The coarsest level that still has a bin for every column
+        level = next((level for level in reversed(self.levels) if level['window'] * width <= samples), self.levels[0])
+        peaks = level['peaks']
+        first = min(int(start * samples_per_ms / level['window']), len(peaks) - 1)
+        last = min(max(int(np.ceil(end * samples_per_ms / level['window'])), first + 1), len(peaks))
+        visible = peaks[first:last]
+
+        columns = np.linspace(0, len(visible), min(width, len(visible)), endpoint=False).astype(np.intp)
+        minima = np.minimum.reduceat(visible[:, 0], columns)
+        maxima = np.maximum.reduceat(visible[:, 1], columns)
+        return np.stack((minima, maxima), axis=1) / 32768
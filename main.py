@@ -4,6 +4,8 @@ from view.view import View
 def main():
     controller = Controller()
     window = View(controller)
+    # Picks up the jobs a previous run did not finish
+    controller.resume_jobs()
     window.mainloop()
 
 if __name__ == '__main__':
@@ -0,0 +1,192 @@
+import sys
+import json
+import time
+import queue
+import argparse
+import contextlib
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List
+from utils.utils import parse_timestamp
+
+# The controller is imported in main(), like the CLI, so importing this module stays cheap
+
+class JobRequestHandler(BaseHTTPRequestHandler):
+    server_version = 'MP3YouTubeDownloader/1.0'
+    # Seconds between keep-alive comments on idle event streams
+    event_stream_keepalive = 15
+
+    @property
+    def controller(self):
+        return self.server.controller
+
+    def do_GET(self) -> None:
+        parts = self.path.split('?', 1)[0].strip('/').split('/')
+        match parts:
+            case ['health']:
+                self.send_json(HTTPStatus.OK, {'status': 'ok', 'pending_jobs': self.controller.pending_jobs})
+            case ['metrics']:
+                self.send_text(HTTPStatus.OK, self.controller.metrics_text(), 'text/plain; version=0.0.4')
+            case ['jobs']:
+                self.send_json(HTTPStatus.OK, {'jobs': [job.to_dict() for job in list(self.controller.jobs)]})
+            case ['jobs', job_id]:
+                job = self.find_job(job_id)
+                if job is not None:
+                    self.send_json(HTTPStatus.OK, job.to_dict())
+            case ['jobs', job_id, 'events']:
+                job = self.find_job(job_id)
+                if job is not None:
+                    self.stream_events(job)
+            case _:
+                self.send_error_json(HTTPStatus.NOT_FOUND, 'Not found')
+
+    def do_POST(self) -> None:
+        if self.path.split('?', 1)[0].strip('/') != 'jobs':
+            self.send_error_json(HTTPStatus.NOT_FOUND, 'Not found')
+            return
+
+        # Backpressure: refuse new work instead of queueing without bound
+        if self.controller.pending_jobs >= self.server.max_pending_jobs:
+            self.send_error_json(HTTPStatus.TOO_MANY_REQUESTS, 'Too many pending jobs, try again later',
+                                 headers={'Retry-After': '30'})
+            return
+
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            body = json.loads(self.rfile.read(length) or b'{}')
+            job = self.create_job(body)
+        except (ValueError, TypeError, KeyError) as e:
+            self.send_error_json(HTTPStatus.BAD_REQUEST, str(e))
+            return
+
+        self.controller.submit(job)
+        self.send_json(HTTPStatus.ACCEPTED, {'id': job.id}, headers={'Location': f'/jobs/{job.id}'})
+
+    def create_job(self, body: Dict[str, any]):
+        if not isinstance(body, dict) or not isinstance(body.get('url'), str) or body['url'] == '':
+            raise ValueError('A "url" is required')
+
+        trim_timestamps = {'start': self.parse_time(body.get('start')), 'end': self.parse_time(body.get('end'))}
+        self.controller.validate_trim_timestamps(trim_timestamps)
+        priority = int(body.get('priority', 0))
+        job = self.controller.create_job(body['url'], body.get('filename', ''), trim_timestamps, body.get('codec', ''),
+                                         bool(body.get('split_chapters', False)), priority)
+        job.profile = bool(body.get('profile', False))
+        return job
+
+    @staticmethod
+    def parse_time(value: str | List[int | float] | None) -> List[int | float]:
+        if value is None:
+            return [0, 0, 0]
+        if isinstance(value, list):
+            return parse_timestamp(':'.join(str(part) for part in value))
+        return parse_timestamp(str(value))
+
+    def find_job(self, job_id: str):
+        job = self.controller.get_job(int(job_id)) if job_id.isdigit() else None
+        if job is None:
+            self.send_error_json(HTTPStatus.NOT_FOUND, f'No job with id {job_id}')
+        return job
+
+    def stream_events(self, job) -> None:
+        # Server-sent events, one per change of the job, until the job is finished
+        events = queue.Queue()
+        listener = lambda changed_job: events.put(changed_job) if changed_job is job else None
+        self.controller.add_listener(listener)
+        try:
+            self.send_response(HTTPStatus.OK)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.send_header('Cache-Control', 'no-cache')
+            self.end_headers()
+
+            self.write_event(job)
+            while not job.finished:
+                try:
+                    events.get(timeout=self.event_stream_keepalive)
+                except queue.Empty:
+                    self.wfile.write(b': keep-alive\n\n')
+                    self.wfile.flush()
+                    continue
+                # Coalesces everything that happened while the last event was written
+                while not events.empty():
+                    events.get_nowait()
+                self.write_event(job)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            self.controller.remove_listener(listener)
+
+    def write_event(self, job) -> None:
+        self.wfile.write(f'event: job\ndata: {json.dumps(job.to_dict(), default=str)}\n\n'.encode())
+        self.wfile.flush()
+
+    def send_json(self, status: HTTPStatus, data: Dict[str, any], headers: Dict[str, str] | None = None) -> None:
+        self.send_text(status, json.dumps(data, default=str), 'application/json', headers)
+
+    def send_text(self, status: HTTPStatus, text: str, content_type: str, headers: Dict[str, str] | None = None) -> None:
+        body = text.encode()
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_error_json(self, status: HTTPStatus, message: str, headers: Dict[str, str] | None = None) -> None:
+        self.send_json(status, {'error': message}, headers)
+
+    def log_message(self, format: str, *args) -> None:
+        sys.stderr.write(f'[JobServer] {self.address_string()} {format % args}\n')
+
+class JobServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, controller, address: str = '127.0.0.1', port: int = 8080, max_pending_jobs: int = 100,
+                 job_retention: float = 3600) -> None:
+        super().__init__((address, port), JobRequestHandler)
+        self.controller = controller
+        self.max_pending_jobs: int = max_pending_jobs
+        # Finished jobs can be queried for this many seconds, then they are dropped
+        self.job_retention: float = job_retention
+        self.__last_prune: float = time.monotonic()
+
+    def service_actions(self) -> None:
+        # Called by serve_forever between requests, the jobs are pruned at most once a minute
+        if time.monotonic() - self.__last_prune >= min(self.job_retention, 60):
+            self.__last_prune = time.monotonic()
+            self.controller.clear_finished_jobs(self.job_retention)
+
+def main(argv: List[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog='mp3-yt-downloader-server',
+                                     description='Local HTTP server to submit downloads to one shared downloader.')
+    parser.add_argument('--host', default='127.0.0.1', help='address to listen on')
+    parser.add_argument('--port', type=int, default=8080, help='port to listen on')
+    parser.add_argument('-w', '--workers', type=int, help='number of parallel downloads')
+    parser.add_argument('--max-pending', type=int, default=100, help='queued and running jobs before new ones are refused')
+    parser.add_argument('--job-retention', type=float, default=3600, help='seconds finished jobs can still be queried')
+    args = parser.parse_args(argv)
+
+    from controller.controller import Controller
+
+    # Keeps stdout free of yt_dlp output, the request log goes to stderr as well
+    with contextlib.redirect_stdout(sys.stderr):
+        controller = Controller()
+        if args.workers is not None:
+            controller.max_workers = args.workers
+        controller.ydl_opts.update({'quiet': True, 'noprogress': True})
+
+        controller.resume_jobs()
+        server = JobServer(controller, args.host, args.port, args.max_pending, args.job_retention)
+        print(f'[JobServer] Listening on http://{args.host}:{args.port}')
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            controller.shutdown(wait=False, cancel_pending=True)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -11,6 +11,17 @@ setup(
         'pydub',
         'customtkinter'
     ],
+    extras_require={
+        'silence': ['numpy'],
+        'waveform': ['numpy']
+    },
+    entry_points={
+        'console_scripts': [
+            'mp3-yt-downloader=cli.cli:main',
+            'mp3-yt-downloader-server=server.server:main',
+            'mp3-yt-downloader-worker=worker.worker:main'
+        ]
+    },
     url='https://github.com/hugobbi/yt_downloader',
     long_description=open("README.md", encoding="utf-8").read(),
     long_description_content_type="text/markdown",
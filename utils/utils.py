@@ -1,8 +1,9 @@
 import time
 import os
+import hashlib
 import re
-import traceback
-from typing import List
+import contextlib
+from typing import IO, Iterator, List, Set
 
 def get_current_time_string() -> str:
     current_time = time.localtime()
@@ -11,18 +12,58 @@ def get_current_time_string() -> str:
 def get_time_milliseconds(time: List[int]) -> int:
     return time[0] * 3600000 + time[1] * 60000 + time[2] * 1000
 
-def get_latest_file(directory: str) -> str:
+def get_timestamp(milliseconds: int) -> List[int | float]:
+    # Inverse of get_time_milliseconds, seconds keep the milliseconds as decimals
+    hours, rest = divmod(milliseconds, 3600000)
+    minutes, rest = divmod(rest, 60000)
+    seconds = rest // 1000 if rest % 1000 == 0 else rest / 1000
+    return [hours, minutes, seconds]
+
+def parse_timestamp(timestamp: str) -> List[int | float]:
+    # Parses "hh:mm:ss", "mm:ss" or "ss" into [hours, minutes, seconds]
+    parts = [float(part) if '.' in part else int(part) for part in timestamp.strip().split(':')]
+    if len(parts) > 3 or any(part < 0 for part in parts):
+        raise ValueError(f"Invalid timestamp {timestamp}, expected hh:mm:ss")
+    return [0] * (3 - len(parts)) + parts
+
+@contextlib.contextmanager
+def atomic_write(path: str, mode: str = 'w') -> Iterator[IO]:
+    # Written to a temporary file first so a crash never leaves a half written file behind
+    temp_path = path + '.tmp'
     try:
-        files = [f for f in os.listdir(directory) if os.path.isfile(os.path.join(directory, f))]
-        if not files:
-            raise Exception(f"Error! No files found in the directory {directory}")
-        latest_file = max(files, key=lambda f: os.path.getctime(os.path.join(directory, f)))
-    except Exception as e:
-         traceback.print_exc()
-         raise e
+        with open(temp_path, mode) as f:
+            yield f
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+def get_file_hash(filepath: str, chunk_size: int = 1 << 20) -> str:
+    sha256 = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        while chunk := f.read(chunk_size):
+            sha256.update(chunk)
+    return sha256.hexdigest()
 
-    return latest_file
+def sanitize_filename(filename: str) -> str:
+    # Characters that are not allowed in file names on Windows or Linux
+    return re.sub(r'[\\/:*?"<>|\x00-\x1f]', '_', filename).strip() or '_'
+
+ANSI_ESCAPE = re.compile(r'\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])')
 
 def remove_ansi_escape_sequences(s):
-        ansi_escape = re.compile(r'\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])')
-        return ansi_escape.sub('', s)
+        return ANSI_ESCAPE.sub('', s)
+
+def parse_index_ranges(s: str) -> Set[int]:
+    # Parses strings like "1, 4, 7-9" into {1, 4, 7, 8, 9}
+    indices = set()
+    for part in s.replace(' ', '').split(','):
+        if part == '':
+            continue
+        if '-' in part:
+            first, last = part.split('-', 1)
+            indices.update(range(int(first), int(last) + 1))
+        else:
+            indices.add(int(part))
+    return indices
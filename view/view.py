@@ -1,7 +1,11 @@
+import queue
 import threading
+from urllib.parse import urlparse
 import customtkinter as ctk
-from typing import Dict
-from utils.utils import remove_ansi_escape_sequences
+from concurrent.futures import Future
+from typing import Callable, Dict
+from controller.trim import parse_cue_sheet
+from utils.utils import get_time_milliseconds, get_timestamp, parse_index_ranges, remove_ansi_escape_sequences
 
 ctk.set_appearance_mode("System")  # Modes: "System" (standard), "Dark", "Light"
 ctk.set_default_color_theme("blue")  # Themes: "blue" (standard), "green", "dark-blue"
@@ -11,14 +15,27 @@ class View(ctk.CTk):
         super().__init__()
 
         self.controller = controller
-        self.update_time = 1
+        # Controller events are drained at most every n milliseconds (20 Hz). While nothing happens
+        # the interval doubles up to max_idle_time, the first event brings it back
+        self.update_time = 50
+        self.max_idle_time = 800
+        self.idle_time = self.update_time
+        self.events: queue.Queue = queue.Queue()
         self.trim_view = None
         self.audio_settings_view = None
+        self.library_view = None
+        self.job_labels: Dict[int, ctk.CTkLabel] = {}
+        # Metadata of the URL in url_entry, fetched in the background while the form is filled in
+        self.metadata_url: str = ''
+        self.metadata_future: Future | None = None
+        # Typing only prefetches once it paused for this many milliseconds
+        self.metadata_delay = 500
+        self.metadata_after: str | None = None
         self.initialize_interface()
 
     def initialize_interface(self):
         self.title("MP3 YouTube Downloader")
-        self.geometry(f"{1200}x{480}")
+        self.geometry(f"{1200}x{640}")
 
         # Title
         self.title_label = ctk.CTkLabel(self, text="MP3 YouTube Downloader", font=("Fira Sans", 20, 'bold'))
@@ -33,6 +50,11 @@ class View(ctk.CTk):
 
         self.url_entry = ctk.CTkEntry(self.url_frame, width=400, placeholder_text='Insert URL here')
         self.url_entry.pack(side="left", fill="x", expand=True)
+        self.url_entry.bind("<KeyRelease>", self.prefetch_metadata)
+        self.url_entry.bind("<<Paste>>", lambda event: self.after_idle(self.start_metadata_prefetch))
+
+        self.url_info_label = ctk.CTkLabel(self, text="", font=("Fira Sans", 12))
+        self.url_info_label.pack(padx=10, anchor='w')
 
         # Path saved files
         self.path_label = ctk.CTkLabel(self, text="Path of saved files", font=("Fira Sans", 12))
@@ -60,6 +82,9 @@ class View(ctk.CTk):
         self.file_settings_button = ctk.CTkButton(self.settings_button_frame, text="Audio file settings", command=self.open_audio_file_settings_view)
         self.file_settings_button.pack(side="left")
 
+        self.library_button = ctk.CTkButton(self.settings_button_frame, text="Library", command=self.open_library_view)
+        self.library_button.pack(side="left", padx=5)
+
         # Download and trim buttons
         self.action_button_frame = ctk.CTkFrame(self, fg_color='transparent')
         self.action_button_frame.pack(pady=10)
@@ -91,9 +116,18 @@ class View(ctk.CTk):
         self.progress_log = ctk.CTkLabel(self.progress_log_frame, text="", font=("Fira Sans", 12))
         self.progress_log.pack(side="left", fill="y", expand=True)
 
-        # Updating values
-        self.update_progress_bar()
-        self.update_logs()
+        # Download queue
+        self.jobs_label = ctk.CTkLabel(self, text="Download queue", font=("Fira Sans", 12))
+        self.jobs_label.pack(padx=10, anchor='w')
+
+        self.jobs_frame = ctk.CTkScrollableFrame(self, height=120)
+        self.jobs_frame.pack(pady=5, padx=10, fill="both", expand=True)
+
+        # Updating values, the controller pushes its changes into the event queue
+        self.controller.add_listener(self.events.put)
+        self.process_events()
+        # The library index follows the save directories in the background
+        self.controller.watch_library()
 
     def select_directory(self):
         path = ctk.filedialog.askdirectory(mustexist=True, title="Select directory to save files")
@@ -103,22 +137,61 @@ class View(ctk.CTk):
             self.path_entry.insert(0, path)
             self.controller.save_dir = path
             self.path_entry.configure(state="disabled")
+            self.controller.watch_library()
     
-    def download(self):
-        if not self.controller.state == self.controller.State.DOWNLOADING:
-            self.controller.url = self.url_entry.get()
-            download_thread = threading.Thread(target=self.controller.download)
-            download_thread.start()
+    def prefetch_metadata(self, event) -> None:
+        if self.metadata_after is not None:
+            self.after_cancel(self.metadata_after)
+        self.metadata_after = self.after(self.metadata_delay, self.start_metadata_prefetch)
+
+    def start_metadata_prefetch(self) -> None:
+        self.metadata_after = None
+        url = self.url_entry.get().strip()
+        if url == self.metadata_url:
+            return
+        self.metadata_url = url
+        # The extraction of a URL that was replaced is not needed anymore, unless it already started
+        if self.metadata_future is not None:
+            self.metadata_future.cancel()
+        parsed = urlparse(url)
+        is_url = parsed.scheme in ('http', 'https') and '.' in parsed.netloc
+        self.metadata_future = self.controller.prefetch_metadata(url) if is_url else None
+        self.set_label_text(self.url_info_label, "Fetching video information..." if self.metadata_future else "")
+
+    def update_metadata(self) -> None:
+        future, self.metadata_future = self.metadata_future, None
+        try:
+            info = future.result()
+        except Exception as e:
+            self.set_label_text(self.url_info_label, remove_ansi_escape_sequences(f"Unavailable: {e}"))
+            return
+        text = info.get('title') or info.get('id', '')
+        if info.get('duration'):
+            hours, minutes, seconds = get_timestamp(int(info['duration']) * 1000)
+            text += f" ({hours}:{minutes:02d}:{seconds:02d})"
+        self.set_label_text(self.url_info_label, text)
 
-    def open_trim_view(self):
+    def download(self):
+        # Jobs are queued on the controller's worker pool, the thread only covers
+        # the playlist extraction which happens before queueing
+        self.controller.url = self.url_entry.get()
+        download_thread = threading.Thread(target=self.controller.download, daemon=True)
+        download_thread.start()
+
+    def open_trim_view(self, filepath: str = ''):
+        if self.trim_view:
+            if filepath:
+                self.trim_view.set_file(filepath)
+            return
         self.previous_trim_settings = self.controller.save_trim_settings()
         self.controller.reset_trim_settings()
-        if not self.trim_view:
-            def start_trim_view():
-                self.trim_view = TrimView(self)
-                self.trim_view.mainloop()
+        def start_trim_view():
+            self.trim_view = TrimView(self)
+            if filepath:
+                self.trim_view.set_file(filepath)
+            self.trim_view.mainloop()
 
-            self.after(0, start_trim_view)
+        self.after(0, start_trim_view)
     
     def open_audio_file_settings_view(self):
         if not self.audio_settings_view:
@@ -127,46 +200,110 @@ class View(ctk.CTk):
                 self.audio_settings_view.mainloop()
 
             self.after(0, start_audio_file_settings)
+
+    def open_library_view(self):
+        if not self.library_view:
+            def start_library_view():
+                self.library_view = LibraryView(self)
+                self.library_view.mainloop()
+
+            self.after(0, start_library_view)
         
     def update_progress_bar(self):
         # Note: the state of the program is checked in order to avoid
         # useless computation when not needed
         match self.controller.state:
             case self.controller.State.REQUEST:
-                self.progress_percentage.configure(text="0%")
+                self.set_label_text(self.progress_percentage, "0%")
                 self.progress_bar.set(0)
             case self.controller.State.DOWNLOADING:
                 progress_str = remove_ansi_escape_sequences(self.controller.download_status['progress'])
-                self.progress_percentage.configure(text=f"{progress_str}")
-                progress = float(progress_str.replace('%', ''))
-                self.progress_bar.set(progress / 100)
+                self.set_label_text(self.progress_percentage, progress_str)
+                # 'N/A%' or nothing while the size is unknown, the bar keeps its value
+                try:
+                    self.progress_bar.set(float(progress_str.replace('%', '')) / 100)
+                except ValueError:
+                    pass
             case self.controller.State.POSTPROCESSING:
-                self.progress_percentage.configure(text="100%")
+                self.set_label_text(self.progress_percentage, "100%")
                 self.progress_bar.set(1)
-  
-        # Update progress bar every n milliseconds
-        self.after(self.update_time, self.update_progress_bar)
-    
+
     def update_logs(self):
         match self.controller.state:
             case self.controller.State.REQUEST:
-                self.progress_log.configure(text="Requesting information...")
+                text = "Requesting information..."
             case self.controller.State.DOWNLOADING:
-                self.progress_log.configure(text=f"Downloading... SPEED {self.controller.download_status['speed']} ETA {self.controller.download_status['eta']}")
+                text = f"Downloading... SPEED {self.controller.download_status['speed']} ETA {self.controller.download_status['eta']}"
             case self.controller.State.POSTPROCESSING:
-                self.progress_log.configure(text="Postprocessing...")
+                text = "Postprocessing..."
             case self.controller.State.DONE:
                 trim_info = "" if not self.controller.trimmed_download else f",\n{self.controller.trim_filepath}"
-                self.progress_log.configure(text=f"Done! File saved at {self.controller.save_path}{trim_info}")
+                text = f"Done! File saved at {self.controller.save_path}{trim_info}"
+            case self.controller.State.SKIPPED:
+                text = f"Already downloaded! File at {self.controller.save_path}"
             case self.controller.State.TRIMMED:
-                self.progress_log.configure(text=f"File trimmed and saved at {self.controller.trim_filepath}")
+                text = f"File trimmed and saved at {self.controller.trim_filepath}"
+            case self.controller.State.SPLIT:
+                text = f"File split into {len(self.controller.split_filepaths)} tracks, first one at {self.controller.split_filepaths[0]}"
             case self.controller.State.SAVE_DIR_CHANGED:
-                self.progress_log.configure(text=f"Default save directory changed to {self.controller.default_save_dir}")
+                text = f"Default save directory changed to {self.controller.default_save_dir}"
             case self.controller.State.ERROR:
-                self.progress_log.configure(text=f"An error occured: {self.controller.error_message}")
-        
-        # Update logs every n milliseconds
-        self.after(self.update_time, self.update_logs)
+                text = f"An error occured: {self.controller.error_message}"
+            case _:
+                return
+        self.set_label_text(self.progress_log, remove_ansi_escape_sequences(text))
+
+    def update_job(self, job):
+        if job.id not in self.job_labels:
+            self.job_labels[job.id] = ctk.CTkLabel(self.jobs_frame, text="", font=("Fira Sans", 12), anchor='w')
+            self.job_labels[job.id].pack(fill="x", padx=5)
+
+        match job.state:
+            case self.controller.State.DOWNLOADING:
+                status = f"{job.download_status['progress']} SPEED {job.download_status['speed']}"
+            case self.controller.State.DONE:
+                status = f"Done! {job.trim_filepath if job.trimmed_download else job.save_path}"
+                if job.split_filepaths:
+                    status += f" (split into {len(job.split_filepaths)} chapters)"
+            case self.controller.State.SKIPPED:
+                status = f"Already downloaded! {job.save_path}"
+            case self.controller.State.ERROR:
+                status = f"Error: {job.error_message}"
+            case _:
+                status = job.state.name.capitalize()
+        self.set_label_text(self.job_labels[job.id], remove_ansi_escape_sequences(f"#{job.id} {job.url} - {status}"))
+
+    def process_events(self):
+        # Nothing but an empty check is done while idle. Every change since the last
+        # call is coalesced into a single update of each affected widget
+        try:
+            if not self.events.empty():
+                self.idle_time = self.update_time
+                changed_jobs = {}
+                while True:
+                    try:
+                        job = self.events.get_nowait()
+                    except queue.Empty:
+                        break
+                    if job is not None:
+                        changed_jobs[job.id] = job
+
+                self.update_progress_bar()
+                self.update_logs()
+                for job in changed_jobs.values():
+                    self.update_job(job)
+            elif self.metadata_future is None:
+                self.idle_time = min(self.idle_time * 2, self.max_idle_time)
+            if self.metadata_future is not None and self.metadata_future.done():
+                self.update_metadata()
+        finally:
+            # A failed update must not stop the updates that follow
+            self.after(self.idle_time, self.process_events)
+
+    @staticmethod
+    def set_label_text(label, text: str) -> None:
+        if label.cget("text") != text:
+            label.configure(text=text)
     
     def set_trim_timestamp(self, event, entry, timestamp_config: Dict[str, str]) -> None:
         value = entry.get()
@@ -193,6 +330,111 @@ class View(ctk.CTk):
         path = self.path_entry.get()
         if path != '':
             self.controller.set_default_save_dir(path)
+            self.controller.watch_library()
+
+class WaveformView(ctk.CTkCanvas):
+    # Mouse wheel zooms around the cursor, dragging with the right button pans,
+    # the start and end markers are dragged with the left button
+    marker_grab_distance = 8
+
+    def __init__(self, parent, on_marker_moved, **kwargs):
+        super().__init__(parent, height=140, highlightthickness=0, background="#1d1e1e", **kwargs)
+        self.on_marker_moved = on_marker_moved
+        self.peaks = None
+        # Visible range and markers, in milliseconds
+        self.view_start = 0
+        self.view_end = 0
+        self.markers: Dict[str, int] = {'start': 0, 'end': 0}
+        self.dragged_marker = None
+        self.pan_origin = None
+
+        self.bind("<Configure>", lambda event: self.draw())
+        self.bind("<Button-1>", self.grab_marker)
+        self.bind("<B1-Motion>", self.drag_marker)
+        self.bind("<ButtonRelease-1>", lambda event: setattr(self, 'dragged_marker', None))
+        self.bind("<Button-3>", lambda event: setattr(self, 'pan_origin', (event.x, self.view_start, self.view_end)))
+        self.bind("<B3-Motion>", self.pan)
+        self.bind("<MouseWheel>", lambda event: self.zoom(event.x, 0.8 if event.delta > 0 else 1.25))
+        self.bind("<Button-4>", lambda event: self.zoom(event.x, 0.8))
+        self.bind("<Button-5>", lambda event: self.zoom(event.x, 1.25))
+
+    def set_peaks(self, peaks) -> None:
+        self.peaks = peaks
+        self.view_start, self.view_end = 0, peaks.duration
+        self.markers = {'start': 0, 'end': peaks.duration}
+        self.draw()
+
+    def set_marker(self, point: str, milliseconds: int) -> None:
+        if self.peaks is None:
+            return
+        self.markers[point] = min(max(milliseconds, 0), self.peaks.duration)
+        self.draw()
+
+    def time_to_x(self, milliseconds: int) -> float:
+        return (milliseconds - self.view_start) * self.winfo_width() / max(self.view_end - self.view_start, 1)
+
+    def x_to_time(self, x: float) -> int:
+        return int(self.view_start + x * (self.view_end - self.view_start) / max(self.winfo_width(), 1))
+
+    def draw(self) -> None:
+        self.delete("all")
+        if self.peaks is None:
+            return
+        width, height = self.winfo_width(), self.winfo_height()
+        peaks = self.peaks.get_peaks(self.view_start, self.view_end, width)
+        if len(peaks) == 0:
+            return
+
+        # One polygon, the maxima from left to right and the minima back, is much faster to draw than a line per column
+        middle = height / 2
+        xs = [index * width / len(peaks) for index in range(len(peaks))]
+        top = [coordinate for x, high in zip(xs, peaks[:, 1]) for coordinate in (x, middle - high * middle)]
+        bottom = [coordinate for x, low in zip(reversed(xs), peaks[::-1, 0]) for coordinate in (x, middle - low * middle + 1)]
+        self.create_polygon(top + bottom, fill="#3a7ebf", outline="#3a7ebf")
+
+        # Everything outside of the markers is cut
+        start_x, end_x = self.time_to_x(self.markers['start']), self.time_to_x(self.markers['end'])
+        self.create_rectangle(0, 0, start_x, height, fill="#000000", stipple="gray50", width=0)
+        self.create_rectangle(end_x, 0, width, height, fill="#000000", stipple="gray50", width=0)
+        for x in (start_x, end_x):
+            self.create_line(x, 0, x, height, fill="#e0a030", width=2)
+
+    def zoom(self, x: float, factor: float) -> None:
+        if self.peaks is None:
+            return
+        # The time under the cursor stays where it is
+        anchor = self.x_to_time(x)
+        span = min(max((self.view_end - self.view_start) * factor, 50), self.peaks.duration)
+        start = min(max(anchor - (anchor - self.view_start) * span / max(self.view_end - self.view_start, 1), 0),
+                    self.peaks.duration - span)
+        self.view_start, self.view_end = int(start), int(start + span)
+        self.draw()
+
+    def pan(self, event) -> None:
+        if self.peaks is None or self.pan_origin is None:
+            return
+        origin_x, origin_start, origin_end = self.pan_origin
+        shift = (origin_x - event.x) * (origin_end - origin_start) / max(self.winfo_width(), 1)
+        shift = min(max(shift, -origin_start), self.peaks.duration - origin_end)
+        self.view_start, self.view_end = int(origin_start + shift), int(origin_end + shift)
+        self.draw()
+
+    def grab_marker(self, event) -> None:
+        distances = {point: abs(self.time_to_x(time) - event.x) for point, time in self.markers.items()}
+        point = min(distances, key=distances.get)
+        self.dragged_marker = point if distances[point] <= self.marker_grab_distance else None
+
+    def drag_marker(self, event) -> None:
+        if self.peaks is None or self.dragged_marker is None:
+            return
+        milliseconds = self.x_to_time(min(max(event.x, 0), self.winfo_width()))
+        # The start stays before the end
+        if self.dragged_marker == 'start':
+            milliseconds = min(milliseconds, self.markers['end'] - 1)
+        else:
+            milliseconds = max(milliseconds, self.markers['start'] + 1)
+        self.set_marker(self.dragged_marker, milliseconds)
+        self.on_marker_moved(self.dragged_marker, self.markers[self.dragged_marker])
 
 class TrimView(ctk.CTkToplevel):
     def __init__(self, parent):
@@ -205,7 +447,7 @@ class TrimView(ctk.CTkToplevel):
 
     def initialize_interface(self) -> None:
         self.title("Trim")
-        self.geometry(f"{600}x{400}")
+        self.geometry(f"{800}x{680}")
 
         self.label = ctk.CTkLabel(self, text="Trim")
         self.label.pack(pady=10)
@@ -224,6 +466,19 @@ class TrimView(ctk.CTkToplevel):
         self.select_button = ctk.CTkButton(self.path_frame, text="Select", command=self.select_file)
         self.select_button.pack(side="right", padx=5)
 
+        self.latest_button = ctk.CTkButton(self.path_frame, text="Latest download", command=self.select_latest_file)
+        self.latest_button.pack(side="right", padx=5)
+
+        # Waveform of the selected file, its markers and the timestamp entries follow each other
+        self.waveform = WaveformView(self, self.set_marker_timestamp)
+        self.waveform.pack(pady=5, padx=10, fill="x")
+        self.waveform_future: Future | None = None
+
+        # Progress and errors of the waveform and of the tasks below
+        self.status_label = ctk.CTkLabel(self, text="", font=("Fira Sans", 12))
+        self.status_label.pack(padx=10, anchor='w')
+        self.task_future: Future | None = None
+
         # Trim settings
         self.label = ctk.CTkLabel(self, text="Trim file", font=("Fira Sans", 12))
         self.label.pack(pady=5, padx=10, anchor='w')
@@ -288,12 +543,26 @@ class TrimView(ctk.CTkToplevel):
                                    lambda event, value=self.end_second_entry, timestamp_config={'point': 'end', 'time': 'second'}: 
                                    self.parent.set_trim_timestamp(event, value, timestamp_config))
 
+        self.timestamp_entries = {
+            'start': (self.start_hour_entry, self.start_minute_entry, self.start_second_entry),
+            'end': (self.end_hour_entry, self.end_minute_entry, self.end_second_entry),
+        }
+        for entries in self.timestamp_entries.values():
+            for entry in entries:
+                entry.bind("<KeyRelease>", lambda event: self.set_waveform_markers(), add="+")
+
         # Buttons
         self.bottom_buttons = ctk.CTkFrame(self, fg_color='transparent')
         self.bottom_buttons.pack(pady=15, fill="x", side="bottom")
         
         self.close_button = ctk.CTkButton(self.bottom_buttons, text="Trim", height=50, width=100, command=self.trim)
         self.close_button.pack(padx=10)
+
+        self.split_button = ctk.CTkButton(self.bottom_buttons, text="Split with cue sheet", command=self.split)
+        self.split_button.pack(pady=(10, 0), padx=10)
+
+        self.auto_trim_button = ctk.CTkButton(self.bottom_buttons, text="Remove silence", command=self.auto_trim)
+        self.auto_trim_button.pack(pady=(10, 0), padx=10)
         
         self.close_button = ctk.CTkButton(self.bottom_buttons, text="Back", command=self.on_exit)
         self.close_button.pack(pady=15, side="bottom")
@@ -308,12 +577,67 @@ class TrimView(ctk.CTkToplevel):
     def select_file(self):
         filepath = ctk.filedialog.askopenfilename(title="Select file to be trimmed")
         if filepath:
-            self.path_entry.configure(state="normal")
-            self.path_entry.delete(0, ctk.END)
-            self.path_entry.insert(0, filepath)
-            self.path_entry.configure(state="disabled")
+            self.set_file(filepath)
         # Avoids the window to hide behind every open window
         self.lift()
+
+    def select_latest_file(self):
+        # From the library index, the save directories are not listed
+        filepath = self.parent.controller.latest_download()
+        if filepath is not None:
+            self.set_file(filepath)
+
+    def set_file(self, filepath: str) -> None:
+        self.path_entry.configure(state="normal")
+        self.path_entry.delete(0, ctk.END)
+        self.path_entry.insert(0, filepath)
+        self.path_entry.configure(state="disabled")
+        self.load_waveform(filepath)
+
+    def load_waveform(self, filepath: str) -> None:
+        # Computing the peaks decodes the whole file the first time, so it happens off the UI thread
+        future = Future()
+        def load():
+            try:
+                future.set_result(self.parent.controller.load_waveform(filepath))
+            except Exception as e:
+                future.set_exception(e)
+        self.waveform_future = future
+        self.parent.set_label_text(self.status_label, "Loading waveform...")
+        threading.Thread(target=load, daemon=True).start()
+        self.after(self.parent.update_time, self.show_waveform, future)
+
+    def show_waveform(self, future: Future) -> None:
+        if not self.winfo_exists() or future is not self.waveform_future:
+            return
+        if not future.done():
+            self.after(self.parent.update_time, self.show_waveform, future)
+            return
+        error = future.exception()
+        if error is None:
+            self.waveform.set_peaks(future.result())
+            self.set_waveform_markers()
+            self.parent.set_label_text(self.status_label, "")
+        elif isinstance(error, ImportError):
+            # numpy is only installed with the waveform extra
+            self.parent.set_label_text(self.status_label, 'Waveform unavailable: install the waveform extra '
+                                                          '(pip install "MP3 YouTube Downloader[waveform]")')
+        else:
+            self.parent.set_label_text(self.status_label, remove_ansi_escape_sequences(f"Waveform unavailable: {error}"))
+
+    def set_waveform_markers(self) -> None:
+        # Unset timestamps leave the markers at the ends of the file
+        for point, timestamp in self.parent.controller.trim_timestamps.items():
+            milliseconds = get_time_milliseconds(timestamp)
+            if milliseconds != 0:
+                self.waveform.set_marker(point, milliseconds)
+
+    def set_marker_timestamp(self, point: str, milliseconds: int) -> None:
+        timestamp = get_timestamp(milliseconds)
+        self.parent.controller.trim_timestamps[point] = timestamp
+        for entry, value in zip(self.timestamp_entries[point], timestamp):
+            entry.delete(0, ctk.END)
+            entry.insert(0, str(value))
     
     def trim(self):
         if self.parent.controller.trim_timestamps_not_set:
@@ -323,6 +647,142 @@ class TrimView(ctk.CTkToplevel):
         if self.parent.controller.should_trim:
             self.parent.controller.trim_audio_file(self.path_entry.get())
 
+    def auto_trim(self):
+        # Cuts leading and trailing silence, the timestamps are detected instead of typed
+        filepath = self.path_entry.get()
+        def auto_trim() -> str:
+            self.parent.controller.auto_trim_audio_file(filepath)
+            return f"Saved at {self.parent.controller.trim_filepath}"
+        self.run_task("Removing silence...", auto_trim)
+
+    def run_task(self, text: str, task: Callable[[], str]) -> None:
+        # Silence detection, trimming and splitting decode whole files, so they run off the UI thread
+        # like the waveform. The task returns the text shown once it is done
+        future = Future()
+        def run():
+            try:
+                future.set_result(task())
+            except Exception as e:
+                future.set_exception(e)
+        self.task_future = future
+        self.auto_trim_button.configure(state="disabled")
+        self.split_button.configure(state="disabled")
+        self.parent.set_label_text(self.status_label, text)
+        threading.Thread(target=run, daemon=True).start()
+        self.after(self.parent.update_time, self.show_task, future)
+
+    def show_task(self, future: Future) -> None:
+        if not self.winfo_exists() or future is not self.task_future:
+            return
+        if not future.done():
+            self.after(self.parent.update_time, self.show_task, future)
+            return
+        self.auto_trim_button.configure(state="normal")
+        self.split_button.configure(state="normal")
+        text = future.result() if future.exception() is None else f"Failed: {future.exception()}"
+        self.parent.set_label_text(self.status_label, remove_ansi_escape_sequences(text))
+
+    def split(self):
+        # Cuts the file into every segment of a .cue sheet or a chapter list ("00:00 Intro" per line)
+        cue_filepath = ctk.filedialog.askopenfilename(title="Select cue sheet or chapter list",
+                                                      filetypes=[("Cue sheets", "*.cue *.txt"), ("All files", "*")])
+        self.lift()
+        if not cue_filepath:
+            return
+        filepath = self.path_entry.get()
+        def split() -> str:
+            # Parse errors of the cue sheet are shown like those of the split
+            with open(cue_filepath, 'r', encoding='utf-8') as f:
+                segments = parse_cue_sheet(f.read())
+            return f"Split into {len(self.parent.controller.split_audio_file(filepath, segments))} files"
+        self.run_task("Splitting...", split)
+
+class LibraryView(ctk.CTkToplevel):
+    def __init__(self, parent):
+        super().__init__(parent)
+
+        self.parent = parent
+        self.transient(parent)
+        self.result_labels = []
+        self.scan_future: Future | None = None
+        self.initialize_interface()
+
+    def initialize_interface(self) -> None:
+        self.title("Library")
+        self.geometry(f"{800}x{520}")
+
+        self.label = ctk.CTkLabel(self, text="Library", font=("Fira Sans", 12, "bold"))
+        self.label.pack(pady=10)
+
+        # Search
+        self.search_frame = ctk.CTkFrame(self, fg_color='transparent')
+        self.search_frame.pack(pady=5, padx=10, fill="x")
+
+        self.search_entry = ctk.CTkEntry(self.search_frame, width=400, placeholder_text="Search by title or path")
+        self.search_entry.pack(side="left", fill="x", expand=True)
+        self.search_entry.bind("<KeyRelease>", lambda event: self.update_results())
+
+        self.scan_button = ctk.CTkButton(self.search_frame, text="Rescan", command=self.scan)
+        self.scan_button.pack(side="right", padx=5)
+
+        self.status_label = ctk.CTkLabel(self, text="", font=("Fira Sans", 12))
+        self.status_label.pack(padx=10, anchor='w')
+
+        # Newest files first, clicking one opens it in the trim view
+        self.results_frame = ctk.CTkScrollableFrame(self)
+        self.results_frame.pack(pady=5, padx=10, fill="both", expand=True)
+
+        self.back_button = ctk.CTkButton(self, text="Back", command=self.on_exit)
+        self.back_button.pack(pady=15, side="bottom")
+
+        self.protocol("WM_DELETE_WINDOW", self.on_exit)
+        self.update_results()
+
+    def on_exit(self):
+        self.parent.library_view = None
+        self.destroy()
+
+    def update_results(self) -> None:
+        for label in self.result_labels:
+            label.destroy()
+        self.result_labels = []
+        entries = self.parent.controller.search_library(self.search_entry.get().strip())
+        for entry in entries:
+            text = entry['title']
+            if entry['duration']:
+                hours, minutes, seconds = get_timestamp(entry['duration'] // 1000 * 1000)
+                text += f" ({hours}:{minutes:02d}:{seconds:02d})"
+            label = ctk.CTkLabel(self.results_frame, text=f"{text} - {entry['path']}", font=("Fira Sans", 12), anchor='w', cursor="hand2")
+            label.pack(fill="x", padx=5)
+            label.bind("<Button-1>", lambda event, filepath=entry['path']: self.parent.open_trim_view(filepath))
+            self.result_labels.append(label)
+        self.parent.set_label_text(self.status_label, f"{len(entries)} files" if entries else "No files found")
+
+    def scan(self) -> None:
+        # Stat diff of the save directories, off the UI thread since it touches every file
+        future = Future()
+        def scan():
+            try:
+                future.set_result(self.parent.controller.scan_library())
+            except Exception as e:
+                future.set_exception(e)
+        self.scan_future = future
+        self.scan_button.configure(state="disabled")
+        self.parent.set_label_text(self.status_label, "Scanning...")
+        threading.Thread(target=scan, daemon=True).start()
+        self.after(self.parent.update_time, self.show_scan, future)
+
+    def show_scan(self, future: Future) -> None:
+        if not self.winfo_exists() or future is not self.scan_future:
+            return
+        if not future.done():
+            self.after(self.parent.update_time, self.show_scan, future)
+            return
+        self.scan_button.configure(state="normal")
+        self.update_results()
+        if future.exception() is not None:
+            self.parent.set_label_text(self.status_label, f"Scan failed: {future.exception()}")
+
 class AudioFileView(ctk.CTkToplevel):
     def __init__(self, parent):
         super().__init__(parent)
@@ -333,7 +793,7 @@ class AudioFileView(ctk.CTkToplevel):
     
     def initialize_interface(self) -> None:
         self.title("Audio settings")
-        self.geometry(f"{400}x{250}")
+        self.geometry(f"{400}x{420}")
 
         # Window title
         self.label = ctk.CTkLabel(self, text="Audio file settings", font=("Fira Sans", 12, "bold"))
@@ -411,6 +871,25 @@ class AudioFileView(ctk.CTkToplevel):
                                    lambda event, value=self.end_second_entry, timestamp_config={'point': 'end', 'time': 'second'}: 
                                    self.parent.set_trim_timestamp(event, value, timestamp_config))
 
+        # Chapter settings
+        self.chapters_checkbox = ctk.CTkCheckBox(self, text="Split into chapters", command=self.set_split_chapters)
+        self.chapters_checkbox.pack(pady=5, padx=10, anchor='w')
+        if self.parent.controller.split_chapters:
+            self.chapters_checkbox.select()
+
+        # Playlist settings
+        self.playlist_checkbox = ctk.CTkCheckBox(self, text="Playlist/channel mode", command=self.set_playlist_mode)
+        self.playlist_checkbox.pack(pady=5, padx=10, anchor='w')
+        if self.parent.controller.playlist_mode:
+            self.playlist_checkbox.select()
+
+        self.label = ctk.CTkLabel(self, text="Playlist entries not to trim", font=("Fira Sans", 12))
+        self.label.pack(pady=5, padx=10, anchor='w')
+
+        self.trim_skip_entry = ctk.CTkEntry(self, width=400, placeholder_text="e.g. 1, 4, 7-9")
+        self.trim_skip_entry.pack(anchor="w", padx=10, fill="x")
+        self.trim_skip_entry.bind("<KeyRelease>", self.set_playlist_trim_skip)
+
         # Back button
         self.back_button = ctk.CTkButton(self, text="Back", command=self.on_exit)
         self.back_button.pack(pady=15, side="bottom")
@@ -423,4 +902,16 @@ class AudioFileView(ctk.CTkToplevel):
 
     def set_file_name(self, event) -> None:
         self.parent.controller.custom_filename = self.file_name_entry.get()
+
+    def set_split_chapters(self) -> None:
+        self.parent.controller.split_chapters = bool(self.chapters_checkbox.get())
+
+    def set_playlist_mode(self) -> None:
+        self.parent.controller.playlist_mode = bool(self.playlist_checkbox.get())
+
+    def set_playlist_trim_skip(self, event) -> None:
+        try:
+            self.parent.controller.playlist_trim_skip = parse_index_ranges(self.trim_skip_entry.get())
+        except ValueError:
+            return
         
\ No newline at end of file
@@ -0,0 +1,193 @@
+import os
+import sys
+import time
+import argparse
+import threading
+import contextlib
+from typing import Dict, List
+from controller.spool import Lease, Spool
+from utils.utils import parse_timestamp
+
+# The controller is imported in main(), like the CLI, so importing this module stays cheap
+
+class SpoolWorker:
+    # Claims jobs from the spool while the controller has free workers, runs them with the regular
+    # download logic and writes their status and results back to the spool
+    def __init__(self, controller, spool: Spool, poll_interval: float = 5.0, status_interval: float = 5.0) -> None:
+        self.controller = controller
+        self.spool: Spool = spool
+        self.poll_interval: float = poll_interval
+        # Progress is written at most once per interval, state changes always are
+        self.status_interval: float = status_interval
+        self.results_dir: str = os.path.join(spool.directory, 'results')
+        self.leases: Dict[int, Lease] = {}
+        self.jobs: Dict[int, any] = {}
+        self.__last_status: Dict[int, tuple] = {}
+        self.__lock = threading.Lock()
+        self.__stop = threading.Event()
+
+    def stop(self) -> None:
+        self.__stop.set()
+
+    def create_job(self, body: Dict[str, any]):
+        # The fields of the server's POST /jobs body, plus the save directory (relative to the spool)
+        if 'error' in body:
+            raise ValueError(body['error'])
+        if not isinstance(body.get('url'), str) or body['url'] == '':
+            raise ValueError('A "url" is required')
+        trim_timestamps = {point: parse_timestamp(str(body[point])) if body.get(point) is not None else [0, 0, 0]
+                           for point in ('start', 'end')}
+        self.controller.validate_trim_timestamps(trim_timestamps)
+        job = self.controller.create_job(body['url'], body.get('filename', ''), trim_timestamps, body.get('codec', ''),
+                                         bool(body.get('split_chapters', False)), int(body.get('priority', 0)))
+        job.save_dir = os.path.join(self.spool.directory, body['save_dir']) if body.get('save_dir') else self.results_dir
+        return job
+
+    def write_status(self, job) -> None:
+        # Controller listener, called from the download workers
+        if job is None:
+            return
+        with self.__lock:
+            lease = self.leases.get(job.id)
+            if lease is None or lease.lost:
+                return
+            now = time.monotonic()
+            last_state, last_time = self.__last_status.get(job.id, (None, 0.0))
+            if job.state.name == last_state and now - last_time < self.status_interval and not job.finished:
+                return
+            self.__last_status[job.id] = (job.state.name, now)
+        self.spool.write_status(lease.name, {**job.to_dict(), 'worker': self.spool.worker_id,
+                                             'attempts': lease.body.get('attempts', 1), 'updated': time.time()})
+
+    def start(self, lease: Lease) -> None:
+        try:
+            job = self.create_job(lease.body)
+        except (ValueError, TypeError) as e:
+            self.spool.write_status(lease.name, {'state': 'ERROR', 'error': str(e), 'worker': self.spool.worker_id,
+                                                 'updated': time.time()})
+            self.spool.finish(lease, 'failed')
+            return
+        with self.__lock:
+            self.leases[job.id] = lease
+            self.jobs[job.id] = job
+        self.controller.submit(job)
+
+    def renew(self) -> None:
+        # Renewed once a third of the lease is left
+        for lease in list(self.leases.values()):
+            if not lease.lost and lease.expires - time.time() < self.spool.lease_seconds / 3:
+                if not self.spool.renew(lease):
+                    print(f'[SpoolWorker] Lost the lease of {lease.name}, another worker runs it now', file=sys.stderr)
+
+    def collect(self) -> None:
+        for job_id, job in list(self.jobs.items()):
+            if not job.finished:
+                continue
+            lease = self.leases[job_id]
+            self.write_status(job)
+            if job.state == self.controller.State.ERROR:
+                # Another attempt, possibly on another worker
+                directory = 'pending' if lease.body.get('attempts', 1) < self.controller.max_attempts else 'failed'
+            else:
+                directory = 'done'
+            self.spool.finish(lease, directory)
+            with self.__lock:
+                del self.jobs[job_id]
+                del self.leases[job_id]
+                self.__last_status.pop(job_id, None)
+            self.controller.clear_finished_jobs()
+
+    def release(self, job_id: int) -> None:
+        # Back to pending for the other workers instead of waiting for the lease to expire
+        with self.__lock:
+            lease = self.leases.pop(job_id)
+            self.jobs.pop(job_id, None)
+            self.__last_status.pop(job_id, None)
+        self.spool.finish(lease, 'pending')
+
+    def drain(self) -> None:
+        # Jobs that did not start are released right away. Running ones keep their (renewed) leases
+        # until they finished, another worker would run them a second time otherwise
+        self.controller.shutdown(wait=False, cancel_pending=True)
+        while self.jobs:
+            for job_id, job in list(self.jobs.items()):
+                if job.future is not None and job.future.cancelled():
+                    self.release(job_id)
+            self.renew()
+            self.collect()
+            if self.jobs:
+                time.sleep(min(self.poll_interval, 1.0))
+
+    def run(self, once: bool = False) -> int:
+        # Returns the number of jobs that were run. With once, returns when the spool is empty
+        self.controller.add_listener(self.write_status)
+        count = 0
+        try:
+            while not self.__stop.is_set():
+                self.spool.reclaim_expired()
+                self.renew()
+                self.collect()
+                claimed = False
+                while len(self.leases) < self.controller.max_workers:
+                    lease = self.spool.claim()
+                    if lease is None:
+                        break
+                    claimed = True
+                    count += 1
+                    self.start(lease)
+                if once and not claimed and not self.leases:
+                    break
+                # Finished jobs are picked up sooner than new ones
+                self.__stop.wait(min(self.poll_interval, 1.0) if self.leases else self.poll_interval)
+        finally:
+            self.controller.remove_listener(self.write_status)
+        return count
+
+def main(argv: List[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog='mp3-yt-downloader-worker',
+                                     description='Run the jobs of a spool directory shared by several workers, e.g. on a NAS. '
+                                                 'Jobs are JSON files in <spool>/pending with the fields of the server\'s POST /jobs.')
+    parser.add_argument('spool', help='spool directory')
+    parser.add_argument('--submit', nargs='+', metavar='URL', help='add jobs for these URLs to the spool and exit')
+    parser.add_argument('-w', '--workers', type=int, help='number of parallel downloads of this worker')
+    parser.add_argument('--id', help='worker id in leases and status files (defaults to host name and pid)')
+    parser.add_argument('--lease', type=float, default=300, help='seconds a claimed job stays leased without renewal')
+    parser.add_argument('--poll', type=float, default=5, help='seconds between looks at the spool')
+    parser.add_argument('--once', action='store_true', help='exit once the spool is empty instead of waiting for jobs')
+    args = parser.parse_args(argv)
+
+    spool = Spool(args.spool, args.id, args.lease)
+    if args.submit:
+        for url in args.submit:
+            print(spool.submit({'url': url}))
+        return 0
+
+    from controller.controller import Controller
+
+    # Keeps stdout free of yt_dlp output, like the server
+    with contextlib.redirect_stdout(sys.stderr):
+        controller = Controller()
+        if args.workers is not None:
+            controller.max_workers = args.workers
+        controller.ydl_opts.update({'quiet': True, 'noprogress': True})
+        # The spool is where jobs are persisted, a restarted worker must not resume them from its own store
+        controller.persist_jobs = False
+
+        worker = SpoolWorker(controller, spool, args.poll)
+        print(f'[SpoolWorker] {spool.worker_id} working on {os.path.abspath(args.spool)}')
+        try:
+            count = worker.run(args.once)
+        except KeyboardInterrupt:
+            print(f'[SpoolWorker] Stopping, waiting for {len(worker.jobs)} jobs to finish or be released')
+            try:
+                worker.drain()
+            except KeyboardInterrupt:
+                # The leases of the running jobs are left to expire, then other workers take them over
+                pass
+            return 130
+        controller.shutdown()
+        print(f'[SpoolWorker] {count} jobs run')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())